@@ -0,0 +1,226 @@
+'''bulk_insert -- insert DataFrames in batches of positional rows
+
+`DataFrame.to_sql` goes through SQLAlchemy's generic executemany,
+building a dict per row. An `ArrayWriter` instead converts each column
+to a list of python values once, tells cx_Oracle the column types up
+front, and passes batches of row tuples straight to the DB-API
+`executemany`, which cx_Oracle sends as one array DML call per batch.
+
+Let's try it out with an in-memory SQLite database::
+
+    >>> import sqlalchemy as sqla
+    >>> db = sqla.create_engine('sqlite://')
+    >>> fact = sqla.Table('observation_fact_1', sqla.MetaData(),
+    ...                   sqla.Column('concept_cd', sqla.String(50)),
+    ...                   sqla.Column('instance_num', sqla.Integer),
+    ...                   sqla.Column('nval_num', sqla.Float),
+    ...                   sqla.Column('start_date', sqla.DateTime))
+    >>> fact.create(db)
+
+    >>> facts = pd.DataFrame(dict(
+    ...     concept_cd=['ICD9:250', 'DRG:123', None],
+    ...     instance_num=[1000, 2000, 3000],
+    ...     nval_num=[1.5, np.nan, 3.0],
+    ...     start_date=pd.to_datetime(['2001-01-01', None, '2001-01-03'])),
+    ...     columns=['concept_cd', 'instance_num', 'nval_num', 'start_date'])
+
+    >>> writer = ArrayWriter(batch_size=2)
+    >>> with db.connect() as conn:
+    ...     writer.insert(conn, fact, facts)
+    3
+    >>> writer.batches
+    2
+
+Nulls (`None`, `NaN`, `NaT`) are bound as SQL NULL::
+
+    >>> for row in db.execute(fact.select().order_by(fact.c.instance_num)):
+    ...     print(row)
+    ('ICD9:250', 1000, 1.5, datetime.datetime(2001, 1, 1, 0, 0))
+    ('DRG:123', 2000, None, None)
+    (None, 3000, 3.0, datetime.datetime(2001, 1, 3, 0, 0))
+
+With `direct_path=True`, we ask Oracle to load each batch above the
+high water mark, and commit after each batch, as direct-path inserts
+require::
+
+    >>> print(ArrayWriter(direct_path=True).statement(db.dialect, fact, ['concept_cd', 'nval_num']))
+    insert /*+ APPEND_VALUES */ into observation_fact_1 (concept_cd, nval_num) values (?, ?)
+
+So we can't do that inside a caller's transaction, where our commits
+would be no-ops and the second batch would fail with ORA-12838::
+
+    >>> with db.connect() as conn:
+    ...     with conn.begin():
+    ...         ArrayWriter(direct_path=True).insert(conn, fact, facts)
+    Traceback (most recent call last):
+      ...
+    ValueError: direct_path insert into observation_fact_1 needs a connection not in a transaction
+
+A failed batch rolls back the batches before it, too (unless they
+were committed, with `direct_path`)::
+
+    >>> keyed = sqla.Table('keyed', sqla.MetaData(),
+    ...                    sqla.Column('instance_num', sqla.Integer, primary_key=True))
+    >>> keyed.create(db)
+    >>> with db.connect() as conn:
+    ...     ArrayWriter(batch_size=2).insert(conn, keyed, pd.DataFrame(dict(instance_num=[1, 2, 1])))
+    ... # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+      ...
+    sqlite3.IntegrityError: UNIQUE constraint failed: keyed.instance_num
+    >>> db.scalar(keyed.count())
+    0
+
+Writers are pluggable by name::
+
+    >>> sorted(writers.keys())
+    ['append_values', 'array', 'to_sql']
+    >>> make_writer('append_values', batch_size=100)
+    ArrayWriter(batch_size=100, direct_path=True)
+
+'''
+
+from typing import Any, Callable, Dict, List
+
+from sqlalchemy.engine import Connection
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+import sqlalchemy as sqla
+
+
+class BulkWriter(object):
+    '''Insert a DataFrame into an existing table.
+    '''
+    batches = 0
+
+    def insert(self, conn: Connection, table: sqla.Table, data: pd.DataFrame) -> int:
+        '''Insert `data` into `table`.
+
+        :return: count of rows inserted
+        '''
+        raise NotImplementedError('subclass must implement')
+
+
+class ToSQLWriter(BulkWriter):
+    '''Insert using `DataFrame.to_sql`.
+    '''
+    def __repr__(self) -> str:
+        return '%s()' % self.__class__.__name__
+
+    def insert(self, conn: Connection, table: sqla.Table, data: pd.DataFrame) -> int:
+        dtype = {c.name: c.type for c in table.columns
+                 if not c.name.endswith('_blob')}
+        data = data.assign(**{name: data[name].astype(object) for name in data.columns
+                              if data[name].dtype.name == 'category'})
+        data.to_sql(name=table.name, schema=table.schema,
+                    con=conn, dtype=dtype,
+                    if_exists='append', index=False)
+        self.batches = 1
+        return len(data)
+
+
+class ArrayWriter(BulkWriter):
+    '''Insert in batches of rows bound positionally, with values converted a column at a time.
+
+    :param batch_size: rows per `executemany` call
+    :param direct_path: use Oracle's `APPEND_VALUES` hint
+                        and commit after each batch.
+    '''
+    def __init__(self, batch_size: int=50000, direct_path: bool=False) -> None:
+        self.batch_size = batch_size
+        self.direct_path = direct_path
+
+    def __repr__(self) -> str:
+        return '%s(batch_size=%d, direct_path=%s)' % (
+            self.__class__.__name__, self.batch_size, self.direct_path)
+
+    def statement(self, dialect: sqla.engine.interfaces.Dialect,
+                  table: sqla.Table, names: List[str]) -> str:
+        preparer = dialect.identifier_preparer
+        hint = '/*+ APPEND_VALUES */ ' if self.direct_path else ''
+        return 'insert %sinto %s (%s) values (%s)' % (
+            hint, preparer.format_table(table),
+            ', '.join(preparer.quote(name) for name in names),
+            ', '.join(_placeholder(dialect.paramstyle, ix) for ix in range(len(names))))
+
+    def insert(self, conn: Connection, table: sqla.Table, data: pd.DataFrame) -> int:
+        cols = [c for c in table.columns if c.name in data.columns]
+        names = [c.name for c in cols]
+        sql = self.statement(conn.dialect, table, names)
+        # Tell cx_Oracle column types up front, lest it guess from a null in the first row.
+        input_sizes = ([c.type.dialect_impl(conn.dialect).get_dbapi_type(conn.dialect.dbapi)
+                        for c in cols]
+                       if conn.dialect.name == 'oracle' else [])
+        values = [bind_values(data[name]) for name in names]
+
+        if self.direct_path and conn.in_transaction():
+            raise ValueError('direct_path insert into %s needs a connection not in a transaction' % table.name)
+        self.batches = 0
+        cursor = conn.connection.cursor()
+        try:
+            trans = conn.begin()
+            try:
+                for lo in range(0, len(data), self.batch_size):
+                    hi = lo + self.batch_size
+                    if input_sizes:
+                        cursor.setinputsizes(*input_sizes)
+                    cursor.executemany(sql, list(zip(*[col[lo:hi] for col in values])))
+                    self.batches += 1
+                    if self.direct_path:
+                        trans.commit()
+                        trans = conn.begin()
+                trans.commit()
+            except:  # noqa: E722
+                trans.rollback()
+                raise
+        finally:
+            cursor.close()
+        return len(data)
+
+
+def bind_values(col: pd.Series) -> List[Any]:
+    '''Convert a column to python values, with None for nulls.
+
+    >>> bind_values(pd.Series([1.5, np.nan]))
+    [1.5, None]
+    >>> bind_values(pd.to_datetime(pd.Series(['2001-02-03', None])))
+    [datetime.datetime(2001, 2, 3, 0, 0), None]
+    >>> bind_values(pd.Series(['DX:1', None, 'DX:1'], dtype='category'))
+    ['DX:1', None, 'DX:1']
+    '''
+    if col.dtype.name == 'category':
+        col = col.astype(object)
+    nulls = col.isnull().values
+    if col.dtype.kind == 'M':
+        values = np.array(col.dt.to_pydatetime(), dtype=object)
+    elif col.dtype.kind in 'biuf':
+        values = np.array(col.values.tolist(), dtype=object)
+    else:
+        values = col.values.copy()
+    if nulls.any():
+        values[nulls] = None
+    return values.tolist()  # type: ignore
+
+
+def _placeholder(paramstyle: str, ix: int) -> str:
+    return (
+        '?' if paramstyle == 'qmark' else
+        '%s' if paramstyle in ('format', 'pyformat') else
+        ':%d' % (ix + 1)  # numeric, named (cx_Oracle binds sequences by position)
+    )
+
+
+writers = {
+    'to_sql': lambda batch_size: ToSQLWriter(),
+    'array': lambda batch_size: ArrayWriter(batch_size),
+    'append_values': lambda batch_size: ArrayWriter(batch_size, direct_path=True),
+}  # type: Dict[str, Callable[[int], BulkWriter]]
+Callable, Dict  # let flake8 know we're using them
+
+
+def make_writer(name: str, batch_size: int) -> BulkWriter:
+    '''Make a BulkWriter by name; see `writers`.
+    '''
+    if name not in writers:
+        raise ValueError('bulk writer %s not in %s' % (name, sorted(writers.keys())))
+    return writers[name](batch_size)
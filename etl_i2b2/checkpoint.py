@@ -0,0 +1,112 @@
+'''checkpoint -- remember how far an upload got, chunk by chunk
+
+A `DataLoadTask` with `resume_chunks` notes, after inserting each
+chunk of facts, how far it got in its source (e.g. the last
+`src_ix`), along with source rows and facts so far. If the task dies
+part way, a retry finds the unfinished upload, keeps its upload_id
+and observation_fact_N table, and carries on after the last
+checkpoint rather than starting over.
+
+Let's try it out with an in-memory SQLite database::
+
+    >>> db = sqla.create_engine('sqlite://')
+    >>> up_t = sqla.Table('upload_status', sqla.MetaData(),
+    ...                   sqla.Column('upload_id', sqla.Integer, primary_key=True),
+    ...                   sqla.Column('transform_name', sqla.String(500)),
+    ...                   sqla.Column('load_status', sqla.String(100)))
+    >>> up_t.create(db)
+    >>> checkpoints = ChunkCheckpoints(schema=None)
+    >>> checkpoints.ensure(db)
+
+    >>> _ = db.execute(up_t.insert(), [dict(upload_id=20, transform_name='CarrierClaimUpload_1_2')])
+    >>> checkpoints.record(db, 20, chunk_num=0, source_position=10000, rows_in=10000, bulk_rows=190000)
+    >>> checkpoints.record(db, 20, chunk_num=1, source_position=20000, rows_in=20000, bulk_rows=385000)
+
+The task died before chunk 2, so upload 20 is unfinished; we pick
+up where chunk 1 left off::
+
+    >>> checkpoints.unfinished(db, up_t, 'CarrierClaimUpload_1_2')
+    20
+    >>> checkpoints.last(db, 20)
+    Checkpoint(upload_id=20, chunk_num=1, source_position=20000, rows_in=20000, bulk_rows=385000)
+
+Once the upload is done, there's nothing to resume::
+
+    >>> _ = db.execute(up_t.update().values(load_status='OK'))
+    >>> checkpoints.unfinished(db, up_t, 'CarrierClaimUpload_1_2') is None
+    True
+    >>> checkpoints.last(db, 21) is None
+    True
+
+'''
+
+from typing import NamedTuple, Optional as Opt, Union
+
+from sqlalchemy.engine import Connection, Engine
+import sqlalchemy as sqla
+
+Checkpoint = NamedTuple('Checkpoint', [
+    ('upload_id', int),
+    ('chunk_num', int),
+    ('source_position', int),
+    ('rows_in', int),
+    ('bulk_rows', int)])
+
+Bind = Union[Connection, Engine]
+
+
+class ChunkCheckpoints(object):
+    '''Checkpoints by upload_id and chunk number, in `schema` (e.g. with upload_status).
+    '''
+    table_name = 'upload_chunk_checkpoint'
+
+    def __init__(self, schema: Opt[str]) -> None:
+        Column, ty = sqla.Column, sqla.types
+        num = ty.Numeric(38, 0, asdecimal=False)
+        self.table = sqla.Table(
+            self.table_name, sqla.MetaData(schema=schema),
+            Column('upload_id', num, primary_key=True),
+            Column('chunk_num', ty.Integer, primary_key=True, autoincrement=False),
+            Column('source_position', num, nullable=False),
+            Column('rows_in', num, nullable=False),
+            Column('bulk_rows', num, nullable=False),
+            Column('checkpoint_date', ty.DateTime))
+
+    def __repr__(self) -> str:
+        return '%s(%s)' % (self.__class__.__name__, self.table.fullname)
+
+    def ensure(self, conn: Bind) -> None:
+        self.table.create(conn, checkfirst=True)
+
+    def record(self, conn: Bind, upload_id: int, chunk_num: int,
+               source_position: int, rows_in: int, bulk_rows: int) -> None:
+        '''Note that chunks through `chunk_num` are committed.
+        '''
+        conn.execute(self.table.insert().values(
+            upload_id=upload_id, chunk_num=chunk_num, source_position=source_position,
+            rows_in=rows_in, bulk_rows=bulk_rows, checkpoint_date=sqla.func.now()))
+
+    def last(self, conn: Bind, upload_id: int) -> Opt[Checkpoint]:
+        t = self.table
+        row = conn.execute(
+            sqla.select([t.c.upload_id, t.c.chunk_num, t.c.source_position, t.c.rows_in, t.c.bulk_rows])
+            .where(t.c.upload_id == upload_id)
+            .order_by(t.c.chunk_num.desc())).fetchone()
+        return None if row is None else Checkpoint(*[int(v) for v in row])
+
+    def unfinished(self, conn: Bind, upload_t: sqla.Table, transform_name: str) -> Opt[int]:
+        '''Find the latest upload for `transform_name` that has checkpoints
+        but no load_status OK, unless a later upload finished.
+        '''
+        t = self.table
+        latest = conn.scalar(
+            sqla.select([sqla.func.max(upload_t.c.upload_id)])
+            .where(upload_t.c.transform_name == transform_name))
+        if latest is None:
+            return None
+        return conn.scalar(
+            sqla.select([upload_t.c.upload_id])
+            .where(sqla.and_(upload_t.c.upload_id == latest,
+                             sqla.or_(upload_t.c.load_status.is_(None),
+                                      upload_t.c.load_status != 'OK'),
+                             sqla.exists().where(t.c.upload_id == upload_t.c.upload_id))))
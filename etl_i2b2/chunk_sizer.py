@@ -0,0 +1,167 @@
+'''chunk_sizer -- tune rows per fetch from how chunks of facts turn out
+
+A fixed `chunk_size` suits some tables poorly: a carrier claim row
+yields a couple dozen facts while an MBSF row yields hundreds.
+A `ChunkSizer` watches facts per row, memory per fact, and insert
+rate, and adjusts rows per fetch to keep each chunk of facts under a
+memory ceiling while bigger chunks keep inserting faster.
+
+    >>> sizer = ChunkSizer(rows=1000, lo=100, hi=100000, fact_mb_max=10)
+
+1000 rows made 30000 facts in 3MB, well under the ceiling, so
+we try bigger chunks::
+
+    >>> sizer.observe(rows_in=1000, fact_qty=30000, fact_bytes=3e6, insert_sec=1.0)
+    (1000, 2000, 'grow: 3.0MB facts at 30000 facts/s')
+
+Bigger chunks insert faster, so we grow again, but only as far as
+fits under the ceiling (3000 bytes per row)::
+
+    >>> sizer.observe(2000, 60000, 6e6, 1.5)
+    (2000, 3333, 'grow: 6.0MB facts at 40000 facts/s; 10MB ceiling')
+
+Once a chunk fits the ceiling, there's nothing to change::
+
+    >>> sizer.observe(3333, 99990, 9.999e6, 2.5) is None
+    True
+
+If rows start making more facts, we shrink to fit::
+
+    >>> sizer.observe(3333, 199980, 1.9998e7, 5)
+    (3333, 1666, 'memory: 20.0MB facts over 10MB ceiling')
+
+If a bigger chunk inserts slower than a smaller one did, we back off
+and stay there::
+
+    >>> sizer = ChunkSizer(rows=1000, lo=100, hi=100000, fact_mb_max=1000)
+    >>> sizer.observe(1000, 30000, 3e6, 1.0)[1]
+    2000
+    >>> sizer.observe(2000, 60000, 6e6, 3.0)
+    (2000, 1000, 'back off: 20000 facts/s < 30000 facts/s at 1000 rows')
+    >>> sizer.observe(1000, 30000, 3e6, 1.0) is None
+    True
+
+Rows per fetch stay within `lo` and `hi`::
+
+    >>> ChunkSizer(rows=1000, lo=500, hi=1500, fact_mb_max=10).observe(1000, 10, 1e3, 1)
+    (1000, 1500, 'grow: 0.0MB facts at 10 facts/s')
+
+With `resident_mb_max`, we also halve chunks when the process as a
+whole gets too big::
+
+    >>> sizer = ChunkSizer(rows=1000, lo=100, hi=100000, fact_mb_max=10, resident_mb_max=2000)
+    >>> sizer.observe(1000, 30000, 3e6, 1.0, resident_mb=2500.0)
+    (1000, 500, 'resident: 2500MB over 2000MB ceiling')
+
+'''
+
+from typing import Optional as Opt, Tuple
+import resource
+
+import pandas as pd  # type: ignore
+
+Change = Tuple[int, int, str]
+
+
+class ChunkSizer(object):
+    '''Tune rows per fetch toward a memory ceiling and the best insert rate.
+
+    :param rows: initial rows per fetch
+    :param lo: fewest rows per fetch
+    :param hi: most rows per fetch
+    :param fact_mb_max: memory ceiling for one chunk of facts
+    :param resident_mb_max: ceiling for the whole process; 0 for none
+    :param growth: factor to grow by while insert rate improves
+    :param tolerance: fraction of the best insert rate a bigger chunk may lose
+    '''
+    def __init__(self, rows: int, lo: int, hi: int, fact_mb_max: float,
+                 resident_mb_max: float=0, growth: float=2.0, tolerance: float=0.1) -> None:
+        self.rows = rows
+        self.lo = lo
+        self.hi = hi
+        self.fact_mb_max = fact_mb_max
+        self.resident_mb_max = resident_mb_max
+        self.growth = growth
+        self.tolerance = tolerance
+        self.settled = False
+        self._best = None  # type: Opt[Tuple[int, float]]
+
+    def __repr__(self) -> str:
+        return '%s(rows=%d, lo=%d, hi=%d, fact_mb_max=%s)' % (
+            self.__class__.__name__, self.rows, self.lo, self.hi, self.fact_mb_max)
+
+    def observe(self, rows_in: int, fact_qty: int, fact_bytes: float, insert_sec: float,
+                resident_mb: Opt[float]=None) -> Opt[Change]:
+        '''Note how a chunk of `rows_in` rows turned out; adjust `rows`.
+
+        :return: (old rows, new rows, reason) if rows changed
+        '''
+        if rows_in <= 0 or fact_qty <= 0:
+            return None
+        fact_mb = fact_bytes / 1e6
+        fit = int(self.fact_mb_max * 1e6 * rows_in / fact_bytes) if fact_bytes > 0 else self.hi
+        rate = fact_qty / max(insert_sec, 1e-6)
+        best = self._best
+        if best is None or rate > best[1]:
+            self._best = (rows_in, rate)
+
+        if self.resident_mb_max and resident_mb is not None and resident_mb > self.resident_mb_max:
+            new = rows_in // 2
+            reason = 'resident: %0.0fMB over %0.0fMB ceiling' % (resident_mb, self.resident_mb_max)
+        elif fit < rows_in:
+            new = fit
+            reason = 'memory: %0.1fMB facts over %0.0fMB ceiling' % (fact_mb, self.fact_mb_max)
+        elif best is not None and rows_in > best[0] and rate < best[1] * (1 - self.tolerance):
+            new = best[0]
+            self.settled = True
+            reason = 'back off: %0.0f facts/s < %0.0f facts/s at %d rows' % (rate, best[1], best[0])
+        elif self.settled:
+            return None
+        else:
+            new = min(int(rows_in * self.growth), fit)
+            reason = 'grow: %0.1fMB facts at %0.0f facts/s' % (fact_mb, rate)
+            if new == fit:
+                reason += '; %0.0fMB ceiling' % self.fact_mb_max
+
+        new = max(self.lo, min(self.hi, new))
+        if new == self.rows:
+            return None
+        old, self.rows = self.rows, new
+        return old, new, reason
+
+
+def frame_bytes(data: pd.DataFrame, sample: int=1000) -> int:
+    '''Estimate memory used by `data` without visiting every string.
+
+    Numeric and categorical columns are sized exactly (categories
+    are stored once); strings in object columns are sized from a
+    sample of about `sample` rows::
+
+        >>> codes = ['ICD9:%03d' % (ix % 7) for ix in range(5000)]
+        >>> data = pd.DataFrame(dict(num=range(5000), code=codes))
+        >>> exact = data.memory_usage(index=False, deep=True).sum()
+        >>> abs(frame_bytes(data) - exact) / exact < 0.01
+        True
+        >>> data['code'] = data.code.astype('category')
+        >>> frame_bytes(data) < exact / 4
+        True
+    '''
+    total = int(data.memory_usage(index=False).sum())
+    objects = [name for name, dtype in data.dtypes.items() if dtype == object]
+    if objects and len(data) > 0:
+        some = data[objects].iloc[::max(1, len(data) // sample)]
+        strings = (some.memory_usage(index=False, deep=True).sum() -
+                   some.memory_usage(index=False).sum())
+        total += int(strings * len(data) / len(some))
+    return total
+
+
+def resident_mb() -> Opt[float]:
+    '''Resident memory of this process, where /proc tells us.
+    '''
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+    return pages * resource.getpagesize() / 1e6
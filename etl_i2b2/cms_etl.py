@@ -9,12 +9,11 @@ Integration Test Usage:
 '''
 
 from datetime import datetime
-from typing import Iterable, List, cast
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional as Opt, Tuple, cast
 import logging
 
 from luigi.parameter import FrozenOrderedDict
 from sqlalchemy import MetaData
-from sqlalchemy.engine import RowProxy
 from sqlalchemy.exc import DatabaseError
 import luigi
 
@@ -48,10 +47,7 @@ class CMSExtract(SourceTask, DBAccessTask):
                             echo=self.echo)
 
     def table_details(self, lc: LoggedConnection, tables: List[str]) -> MetaData:
-        rif_meta = MetaData(schema=self.cms_rif)
-        rif_meta.reflect(only=tables, schema=self.cms_rif,
-                         bind=self._dbtarget().engine)
-        return rif_meta
+        return self.reflect(self.cms_rif, tables)
 
 
 def _deep_requires(t: luigi.Task) -> Iterable[luigi.Task]:
@@ -100,6 +96,40 @@ class _DimensionTask(FromCMS, UploadTask):
         return SqlScriptTask.requires(self) + self.mappings
 
 
+BeneChunk = NamedTuple('BeneChunk', [
+    ('chunk_num', int),
+    ('bene_id_qty', int),
+    ('bene_id_first', str),
+    ('bene_id_last', str)])
+SurveyKey = Tuple[int, Opt[int], datetime]
+Survey = Tuple[List[BeneChunk], Dict[str, Dict[int, int]]]
+
+
+def survey_tables(rows: Iterable[Tuple[Any, ...]]) -> Survey:
+    '''Split joined (chunk, table_name, row_qty) rows into chunks and rows per table by chunk.
+
+    >>> chunks, rows = survey_tables([
+    ...     (1, 10, 'b001', 'b010', 'bcarrier_claims', 25),
+    ...     (1, 10, 'b001', 'b010', 'mbsf_ab_summary', 10),
+    ...     (2, 10, 'b011', 'b020', 'bcarrier_claims', 35),
+    ...     (3, 5, 'b021', 'b025', None, None)])
+    >>> [c.chunk_num for c in chunks]
+    [1, 2, 3]
+    >>> chunks[1]
+    BeneChunk(chunk_num=2, bene_id_qty=10, bene_id_first='b011', bene_id_last='b020')
+    >>> sorted(rows['bcarrier_claims'].items())
+    [(1, 25), (2, 35)]
+    '''
+    chunks = []  # type: List[BeneChunk]
+    tables = {}  # type: Dict[str, Dict[int, int]]
+    for chunk_num, bene_id_qty, bene_id_first, bene_id_last, table_name, row_qty in rows:
+        if not chunks or chunks[-1].chunk_num != chunk_num:
+            chunks.append(BeneChunk(chunk_num, bene_id_qty, bene_id_first, bene_id_last))
+        if table_name is not None:
+            tables.setdefault(table_name, {})[chunk_num] = row_qty
+    return chunks, tables
+
+
 class BeneIdSurvey(FromCMS, SqlScriptTask):
     script = Script.bene_chunks_survey
     bene_chunks = IntParam(default=200,
@@ -116,27 +146,96 @@ class BeneIdSurvey(FromCMS, SqlScriptTask):
     def run(self) -> None:
         SqlScriptTask.run_bound(self, script_params=dict(
             chunk_qty=self.bene_chunks))
+        self._memo.pop(self._memo_key(), None)
+
+    def results(self) -> List[BeneChunk]:
+        return self._survey()[0]
+
+    def table_rows(self, table_name: str) -> Dict[int, int]:
+        '''Rows of `table_name` by chunk_num, if surveyed.
+        '''
+        return self._survey()[1].get(table_name, {})
 
-    def results(self) -> List[RowProxy]:
+    # The scheduler calls requires() of each wrapper task again and
+    # again, so we remember survey results per process.
+    _memo = {}  # type: Dict[SurveyKey, Survey]
+
+    def _memo_key(self) -> SurveyKey:
+        return (self.bene_chunks, self.bene_chunk_max, self.source.download_date)
+
+    def _survey(self) -> Survey:
+        key = self._memo_key()
+        if key in self._memo:
+            return self._memo[key]
+        survey = self._fetch()
+        if survey[0]:  # Don't remember that the survey hasn't run yet.
+            self._memo[key] = survey
+        return survey
+
+    def _fetch(self) -> Survey:
         with self.connection(event='survey results') as lc:
             q = '''
-              select chunk_num
-                , bene_id_qty
-                , bene_id_first
-                , bene_id_last
-              from bene_chunks
-              where chunk_qty = :chunk_qty
+              select c.chunk_num
+                , c.bene_id_qty
+                , c.bene_id_first
+                , c.bene_id_last
+                , r.table_name
+                , r.row_qty
+              from bene_chunks c
+              left join bene_chunk_rows r
+                on r.chunk_qty = c.chunk_qty and r.chunk_num = c.chunk_num
+              where c.chunk_qty = :chunk_qty
                 and (:chunk_max is null or
-                     chunk_num <= :chunk_max)
-              order by chunk_num
+                     c.chunk_num <= :chunk_max)
+              order by c.chunk_num
             '''
             params = dict(chunk_max=self.bene_chunk_max,
                           chunk_qty=self.bene_chunks)  # type: Params
             Params  # tell flake8 we're using it.
             try:
-                return lc.execute(q, params=params).fetchall()
+                return survey_tables(lc.execute(q, params=params).fetchall())
+            except DatabaseError:
+                pass
+            # bene_chunk_rows is missing if the survey predates it.
+            try:
+                q = '''
+                  select chunk_num, bene_id_qty, bene_id_first, bene_id_last
+                  from bene_chunks
+                  where chunk_qty = :chunk_qty
+                    and (:chunk_max is null or
+                         chunk_num <= :chunk_max)
+                  order by chunk_num
+                '''
+                return [BeneChunk(*row) for row in lc.execute(q, params=params).fetchall()], {}
             except DatabaseError:
-                return []
+                return [], {}
+
+    @classmethod
+    def range_rows(cls, lc: LoggedConnection, table_name: str,
+                   bene_id_first: int, bene_id_last: int) -> Opt[int]:
+        '''How many rows of `table_name` are in the surveyed chunk(s)
+        from `bene_id_first` to `bene_id_last`, if we know.
+        '''
+        q = '''
+          select max(row_qty) from (
+            select c.chunk_qty, sum(r.row_qty) row_qty
+            from bene_chunks c
+            join bene_chunk_rows r
+              on r.chunk_qty = c.chunk_qty and r.chunk_num = c.chunk_num
+            where c.bene_id_first >= :bene_id_first
+              and c.bene_id_last <= :bene_id_last
+              and r.table_name = :table_name
+            group by c.chunk_qty
+            having min(c.bene_id_first) = :bene_id_first
+               and max(c.bene_id_last) = :bene_id_last
+          )
+        '''
+        params = dict(table_name=table_name,
+                      bene_id_first=bene_id_first, bene_id_last=bene_id_last)  # type: Params
+        try:
+            return lc.scalar(q, params=params)
+        except DatabaseError:
+            return None
 
 
 class PatientMapping(FromCMS, SqlScriptTask):
@@ -380,12 +380,19 @@ The MAXDATA_IP table has only one procedure date column::
 
 """
 
+from collections import OrderedDict, deque
 from io import StringIO
+from pathlib import Path
+from queue import Queue, Full
+from sys import intern
+from threading import Event, Thread
+import heapq
 import logging
+import multiprocessing
 from random import Random
 from typing import (
-    Any, Iterable, Iterator, List, Dict, Optional as Opt,
-    Tuple, Type, TypeVar, cast)
+    Any, Callable, Iterable, Iterator, List, Dict, NamedTuple, Optional as Opt,
+    Tuple, Type, TypeVar, Union, cast)
 import enum
 
 import cx_ora_fix; cx_ora_fix.patch_version()  # noqa: E702
@@ -396,14 +403,22 @@ import pandas as pd  # type: ignore
 import pkg_resources as pkg
 import sqlalchemy as sqla
 
-from cms_etl import FromCMS, DBAccessTask, BeneIdSurvey, PatientMapping, MedparMapping
+from bulk_insert import BulkWriter, make_writer
+from checkpoint import Checkpoint, ChunkCheckpoints
+from chunk_sizer import ChunkSizer, frame_bytes, resident_mb
+from cms_etl import FromCMS, DBAccessTask, BeneChunk, BeneIdSurvey, PatientMapping, MedparMapping
+from eventlog import EventLogger
 from etl_tasks import (
     LoggedConnection, LogState,
     SqlScriptTask, ReportTask, UploadTarget, UploadTask,
-    make_url, log_plan
+    make_url, log_plan, plan_rows
 )
-from param_val import IntParam, StrParam
+from keyset import KeyRange, fetch_in_order, key_ranges
+from param_val import BoolParam, IntParam, StrParam
+from row_stream import RowStream
+from schema_cache import table_digest
 from script_lib import Script
+from spill import ChunkSpill
 from sql_syntax import Params
 
 log = logging.getLogger(__name__)
@@ -438,16 +453,23 @@ class _LoadTask(FromCMS, DBAccessTask):
         return UploadTarget(self._make_url(self.account),
                             self.project.upload_table,
                             self.task_id, self.source,
-                            echo=self.echo)
+                            echo=self.echo,
+                            status_ttl=self.upload_status_ttl)
 
     def run(self) -> None:
         upload = self._upload_target()
         with upload.job(self,
                         label=self.label,
-                        user_id=make_url(self.account).username) as conn_id_r:
+                        user_id=make_url(self.account).username,
+                        upload_id=self.prior_upload_id()) as conn_id_r:
             lc, upload_id, result = conn_id_r
             self.load(lc, upload, upload_id, result)
 
+    def prior_upload_id(self) -> Opt[int]:
+        '''Continue an earlier upload rather than starting a new one?
+        '''
+        return None
+
     def load(self, lc: LoggedConnection, upload: 'UploadTarget', upload_id: int, result: Params) -> None:
         raise NotImplementedError('subclass must implement')
 
@@ -457,7 +479,7 @@ class _LoadTask(FromCMS, DBAccessTask):
                                    lc._conn).iloc[0][0]
         out = detail[[col.name for col in table_info.columns
                       if col.name in detail.columns.values]].copy()
-        out['sourcesystem_cd'] = self.source.source_cd.replace("'", '')  # kludgy
+        out['sourcesystem_cd'] = _constant(self.source.source_cd.replace("'", ''), len(out))  # kludgy
         out['download_date'] = self.source.download_date
         out['upload_id'] = upload_id
         out['import_date'] = current_time
@@ -465,17 +487,83 @@ class _LoadTask(FromCMS, DBAccessTask):
 
 
 class DataLoadTask(_LoadTask):
+    bulk_writer = StrParam(default='array', significant=False,
+                           description='to_sql, array, or append_values (Oracle direct path); see bulk_insert')
+    insert_batch_size = IntParam(default=50000, significant=False,
+                                 description='rows per executemany() by array writers')
+    pipeline_depth = IntParam(default=0, significant=False,
+                              description='chunks to fetch and pivot ahead of bulk insert; 0 for none')
+    spill_dir = StrParam(default='', significant=False,
+                         description='directory to save chunks of facts in, for replay (needs pyarrow)')
+    replay_upload_id = IntParam(default=0, significant=False,
+                                description='reload observation_fact_N from chunks saved in spill_dir')
+    resume_chunks = BoolParam(default=False, significant=False,
+                              description='checkpoint each chunk; on retry, continue an unfinished upload'
+                              ' (if the source order is stable; see can_resume)')
+
+    def fact_writer(self) -> BulkWriter:
+        return make_writer(self.bulk_writer, self.insert_batch_size)
+
+    def spill(self) -> Opt[ChunkSpill]:
+        return ChunkSpill(Path(self.spill_dir)) if self.spill_dir else None
+
+    def checkpoints(self) -> ChunkCheckpoints:
+        return ChunkCheckpoints(self.project.upload_table.schema)
+
+    def can_resume(self) -> bool:
+        '''Does `obs_data` number source rows the same way every time,
+        so that we can continue after a checkpoint?
+        '''
+        return False
+
+    def resuming(self) -> bool:
+        return self.resume_chunks and not self.replay_upload_id and self.can_resume()
+
+    def prior_upload_id(self) -> Opt[int]:
+        if self.replay_upload_id:
+            return self.replay_upload_id
+        if self.resume_chunks and not self.can_resume():
+            self._log.warning('%(event)s: %(task)s source order is not stable; reloading in full',
+                              dict(event='cannot resume', task=self.task_id))
+        if self.resuming():
+            with self.connection('unfinished upload?') as lc:
+                checkpoints = self.checkpoints()
+                checkpoints.ensure(lc._conn)
+                return checkpoints.unfinished(lc._conn, self.project.upload_table, self.task_id)
+        return None
+
     def load(self, lc: LoggedConnection, upload: 'UploadTarget', upload_id: int, result: Params) -> None:
         [fact_proto] = self.project.table_details(lc, ['observation_fact']).tables.values()
         fact_table = sqla.Table('observation_fact_%s' % upload_id,
                                 sqla.MetaData(),
                                 *[c.copy() for c in fact_proto.columns],
                                 oracle_compress=True)
-        fact_table.create(lc._conn)
-        fact_dtype = {c.name: c.type for c in fact_table.columns
-                      if not c.name.endswith('_blob')}
+        writer = self.fact_writer()
         bulk_rows = 0
-        obs_fact_chunks = self.obs_data(lc, upload_id)
+        chunk_num = 0
+        spill = self.spill()
+        checkpoints = self.checkpoints() if self.resuming() else None
+        resumed = checkpoints.last(lc._conn, upload_id) if checkpoints is not None else None
+        if self.replay_upload_id:
+            if spill is None:
+                raise ValueError('replay_upload_id requires spill_dir')
+            if not spill.complete(upload_id):
+                # e.g. an insert failed before we got the rest of the chunks
+                raise ValueError('cannot replay UP#%d: %s lacks some chunks; reload from the source' % (
+                    upload_id, spill.done_path(upload_id).parent))
+            lc.execute(fact_table.delete())
+            obs_fact_chunks = self.replay(spill, upload_id)
+            spill = None
+        elif resumed is not None:
+            discarded = self.resume_after(lc, fact_table, resumed)
+            lc.log.info('UP#%(upload_id)d: %(event)s after chunk %(chunk_num)d at %(source_position)d;'
+                        ' %(bulk_rows)d facts kept, %(discarded)d discarded',
+                        dict(event='resume', discarded=discarded, **resumed._asdict()))
+            bulk_rows, chunk_num = resumed.bulk_rows, resumed.chunk_num + 1
+            obs_fact_chunks = self.obs_data(lc, upload_id)
+        else:
+            fact_table.create(lc._conn)
+            obs_fact_chunks = self.obs_data(lc, upload_id)
         while 1:
             with lc.log.step('UP#%(upload_id)d: %(event)s from %(input)s',
                              dict(event='ETL chunk', upload_id=upload_id,
@@ -485,9 +573,20 @@ class DataLoadTask(_LoadTask):
                     try:
                         obs_fact_chunk, pct_in = next(obs_fact_chunks)
                     except StopIteration:
+                        if spill is not None:
+                            spill.finish(upload_id, chunk_num)
                         break
-                    step1.msg_parts.append(' %(fact_qty)s facts')
-                    step1.argobj.update(dict(fact_qty=len(obs_fact_chunk)))
+                    fact_bytes = frame_bytes(obs_fact_chunk)
+                    step1.msg_parts.append(
+                        ' %(fact_qty)s facts in %(fact_mb)0.1fMB (%(fact_bytes_each)0.1f bytes each)')
+                    step1.argobj.update(dict(fact_qty=len(obs_fact_chunk),
+                                             fact_mb=fact_bytes / 1e6,
+                                             fact_bytes_each=fact_bytes / max(len(obs_fact_chunk), 1)))
+                    if spill is not None:
+                        spill_path = spill.write(upload_id, chunk_num, obs_fact_chunk)
+                        step1.msg_parts.append(' spilled to %(spill_path)s')
+                        step1.argobj.update(dict(spill_path=str(spill_path)))
+                    chunk_num += 1
                 with lc.log.step('UP#%(upload_id)d: %(event)s %(rowcount)d rows into %(into)s',
                                  dict(event='bulk insert',
                                       upload_id=upload_id,
@@ -495,14 +594,18 @@ class DataLoadTask(_LoadTask):
                                       rowcount=len(obs_fact_chunk))) as insert_step:
                     obs_fact_chunk = _check_start_date(obs_fact_chunk,
                                                        threshold=(0.01, cast(logging.Logger, lc.log)))
-                    obs_fact_chunk.to_sql(name=fact_table.name,
-                                          con=lc._conn,
-                                          dtype=fact_dtype,
-                                          if_exists='append', index=False)
+                    writer.insert(lc._conn, fact_table, obs_fact_chunk)
                     bulk_rows += len(obs_fact_chunk)
-                    insert_step.argobj.update(dict(rowsubtotal=bulk_rows))
+                    position = self.checkpoint_position() if checkpoints is not None else None
+                    if checkpoints is not None and position is not None:
+                        checkpoints.record(lc._conn, upload_id, chunk_num - 1, position[0], position[1], bulk_rows)
+                    _start, _elapsed, insert_us = lc.log.elapsed()
+                    self.chunk_loaded(lc, obs_fact_chunk, fact_bytes, insert_us / 1000000.0)
+                    insert_step.argobj.update(dict(
+                        rowsubtotal=bulk_rows, batches=writer.batches,
+                        rows_per_sec=len(obs_fact_chunk) / (max(insert_us, 1) / 1000000.0)))
                     insert_step.msg_parts.append(
-                        ' (subtotal: %(rowsubtotal)d)')
+                        ' in %(batches)d batches @%(rows_per_sec)0.1f rows/s (subtotal: %(rowsubtotal)d)')
 
                 # report progress via the luigi scheduler and upload_status table
                 _start, elapsed, elapsed_ms = lc.log.elapsed()
@@ -522,6 +625,33 @@ class DataLoadTask(_LoadTask):
     def obs_data(self, lc: LoggedConnection, upload_id: int) -> Iterator[Tuple[pd.DataFrame, float]]:
         raise NotImplementedError
 
+    def chunk_loaded(self, lc: LoggedConnection, facts: pd.DataFrame,
+                     fact_bytes: float, insert_sec: float) -> None:
+        '''Note how the chunk of facts most recently from `obs_data` went.
+        '''
+        pass
+
+    def checkpoint_position(self) -> Opt[Tuple[int, int]]:
+        '''How far into the source, and how many source rows so far,
+        as of the chunk of facts most recently from `obs_data`;
+        None if we can't resume from there.
+        '''
+        return None
+
+    def resume_after(self, lc: LoggedConnection, fact_table: sqla.Table, checkpoint: Checkpoint) -> int:
+        '''Discard facts after `checkpoint` and arrange for `obs_data` to continue from there.
+
+        :return: count of facts discarded
+        '''
+        raise NotImplementedError('%s cannot resume' % self.task_family)
+
+    def replay(self, spill: ChunkSpill, upload_id: int) -> Iterator[Tuple[pd.DataFrame, float]]:
+        '''Get chunks of facts from the spill rather than the source tables.
+        '''
+        chunk_qty = len(spill.chunk_nums(upload_id))
+        for ix, (_chunk_num, obs_fact_chunk) in enumerate(spill.chunks(upload_id)):
+            yield obs_fact_chunk, 100.0 * (ix + 1) / chunk_qty
+
 
 def read_sql_step(sql: str, lc: LoggedConnection, params: Params) -> pd.DataFrame:
     with lc.log.step('%(event)s %(sql1)s' + ('\n%(params)s' if params else ''),
@@ -604,21 +734,55 @@ class MedparMapped(BeneMapped):
         pat_day = out[['bene_id', 'start_day']].drop_duplicates()
 
         # assert(medpar_mapping is 1-1 from medpar_id to encounter_num)
-        pat_enc = pat_day.merge(medpar_mapping, on='bene_id', how='left')
-
-        pat_enc = pat_enc[(pat_enc.start_day >= pat_enc.admsn_dt) &
-                          (pat_enc.start_day <= pat_enc.dschrg_dt)]
-        pat_enc = pat_enc.set_index(['bene_id', 'start_day'])  # [['encounter_num', 'medpar_id']]
-        pat_enc = pat_enc[~pat_enc.index.duplicated(keep='first')]
+        pat_enc = cls.pat_day_stays(pat_day, medpar_mapping)
         out = out.merge(pat_enc, how='left', left_on=['bene_id', 'start_day'], right_index=True)
         assert len(out) == len(data)
 
-        # ISSUE: hash is not portable between python and Oracle
-        fallback = - cls.fmt_patient_day(out).apply(hash).abs()
-        out.encounter_num = out.encounter_num.fillna(fallback)
+        fallback = pd.Series(- patient_day_hash(out.bene_id.values, out.start_date.values),
+                             index=out.index)
+        out.encounter_num = out.encounter_num.fillna(fallback).astype(np.int64)
 
         return out
 
+    @classmethod
+    def pat_day_stays(cls, pat_day: pd.DataFrame, medpar_mapping: pd.DataFrame) -> pd.DataFrame:
+        """Find the first stay (in medpar_mapping order) of each patient day.
+
+        :param pat_day: distinct bene_id, start_day
+        :return: medpar_mapping columns indexed by bene_id, start_day;
+                 patient days with no stay are left out.
+
+        >>> from stay_bench import StayTestData
+        >>> stays = StayTestData.stays(Random(1), bene_qty=20, max_stays=5)
+        >>> pat_day = StayTestData.pat_days(Random(2), stays, qty=200)
+        >>> found = MedparMapped.pat_day_stays(pat_day, stays)
+        >>> (found == MedparMapped.pat_day_stays_merge(pat_day, stays)).all().all()
+        True
+        >>> len(pat_day), len(found)
+        (189, 49)
+        """
+        pos = first_containing(pat_day.bene_id.values, pat_day.start_day.values,
+                               medpar_mapping.bene_id.values,
+                               medpar_mapping.admsn_dt.values, medpar_mapping.dschrg_dt.values)
+        hit = pos >= 0
+        pat_enc = medpar_mapping.drop('bene_id', axis=1).iloc[pos[hit]]
+        pat_enc.index = pd.MultiIndex.from_arrays([pat_day.bene_id.values[hit],
+                                                   pat_day.start_day.values[hit]],
+                                                  names=['bene_id', 'start_day'])
+        return pat_enc
+
+    @classmethod
+    def pat_day_stays_merge(cls, pat_day: pd.DataFrame, medpar_mapping: pd.DataFrame) -> pd.DataFrame:
+        """Reference implementation of `pat_day_stays`: join each
+        patient day with all that patient's stays and filter.
+        """
+        pat_enc = pat_day.merge(medpar_mapping, on='bene_id', how='left')
+
+        pat_enc = pat_enc[(pat_enc.start_day >= pat_enc.admsn_dt) &
+                          (pat_enc.start_day <= pat_enc.dschrg_dt)]
+        pat_enc = pat_enc.set_index(['bene_id', 'start_day'])  # [['encounter_num', 'medpar_id']]
+        return pat_enc[~pat_enc.index.duplicated(keep='first')]
+
     @classmethod
     def fmt_patient_day(cls, df: pd.DataFrame) -> pd.Series:
         return df.start_date.dt.strftime('%Y-%m-%d') + ' ' + df.bene_id
@@ -629,17 +793,48 @@ class MedparMapped(BeneMapped):
 
         if 'medpar_id' in data.columns.values:
             obs = obs.merge(emap[['medpar_id', 'encounter_num']], on='medpar_id', how='left')
+            if not obs.encounter_num.isnull().any():
+                obs.encounter_num = obs.encounter_num.astype(np.int64)
         else:
             obs = self.pat_day_rollup(obs, emap)
 
         if 'provider_id' in obs.columns.values:
-            obs.provider_id = obs.provider_id.where(~obs.provider_id.isnull(), '@')
+            obs.provider_id = _as_codes(obs.provider_id, '@')
         else:
-            obs['provider_id'] = '@'
+            obs['provider_id'] = _constant('@', len(obs))
 
         return obs
 
 
+class ColumnRegistry(object):
+    '''Curated column info, parsed once and indexed by table.
+
+    Structures derived from it are computed on first use and remembered:
+
+    >>> reg = ColumnRegistry(CMSVariables._active_columns.decode('utf-8'))
+    >>> reg.table('PDE').column_name.head(2).tolist()
+    ['PDE_ID', 'BENE_ID']
+    >>> len(reg.table('no_such_table'))
+    0
+    >>> calls = []
+    >>> answer = lambda: calls.append('computed') or 42
+    >>> reg.derived(('answer',), answer), reg.derived(('answer',), answer), calls
+    (42, 42, ['computed'])
+    '''
+    def __init__(self, csv_text: str) -> None:
+        self.col_info = pd.read_csv(StringIO(csv_text))
+        self._by_table = dict(list(self.col_info.groupby('table_name')))
+        self._derived = {}  # type: Dict[Tuple[Any, ...], Any]
+
+    def table(self, table_name: str) -> pd.DataFrame:
+        return self._by_table.get(table_name.lower(), self.col_info.iloc[:0])
+
+    def derived(self, key: Tuple[Any, ...], compute: Callable[[], T]) -> T:
+        if key not in self._derived:
+            self._derived[key] = compute()
+        return cast(T, self._derived[key])
+
+
 class CMSVariables(object):
     r'''CMS Variables are more or less the same as SQL columns.
 
@@ -681,15 +876,23 @@ class CMSVariables(object):
 
     curated_info = 'metadata/active_columns.csv'
     _active_columns = pkg.resource_string(__name__, curated_info)
+    _registry = None  # type: Opt[ColumnRegistry]
+
+    @classmethod
+    def registry(cls) -> ColumnRegistry:
+        '''Get the (process-wide) registry of curated column info.
+        '''
+        if CMSVariables._registry is None:
+            CMSVariables._registry = ColumnRegistry(CMSVariables._active_columns.decode('utf-8'))
+        return CMSVariables._registry
 
     @classmethod
     def active_columns(cls, table_name: str,
                        extras: Iterable[str]=[],
                        active: str='A') -> pd.DataFrame:
-        col_info = pd.read_csv(StringIO(cls._active_columns.decode('utf-8')))
-        return col_info[(col_info.table_name == table_name.lower()) &
-                        (~col_info.Status.isnull() |
-                         col_info.column_name.str.lower().isin(extras))]
+        col_info = cls.registry().table(table_name)
+        return col_info[~col_info.Status.isnull() |
+                        col_info.column_name.str.lower().isin(extras)]
 
     @classmethod
     def column_properties(cls, info: pd.DataFrame) -> pd.DataFrame:
@@ -836,6 +1039,145 @@ def fmt_px_codes(prcdr_cd: pd.Series, prcdr_vrsn: pd.Series,
     return icd9.append([cpt, hcpcs, other])[prcdr_cd.index]
 
 
+class ConceptCodeCache(object):
+    '''Format diagnosis, procedure codes once per distinct (version, code) pair.
+
+    A chunk has millions of stacked diagnoses but only thousands of
+    distinct codes, so we factorize, format only the pairs not seen
+    before (in this or earlier chunks), and broadcast the results back::
+
+        >>> codes = ConceptCodeCache(capacity=3)
+        >>> dx = pd.DataFrame.from_records([
+        ...   ['9',  '4321'],
+        ...   ['9',  '4321'],
+        ...   ['10', 'A12'],
+        ...   [None, 'V5789'],
+        ...  ], columns=['vrsn', 'cd'], index=[10, 11, 12, 13])
+        >>> codes.dx_codes(dx.vrsn, dx.cd)  # doctest: +ELLIPSIS
+        10     ICD9:432.1
+        11     ICD9:432.1
+        12      ICD10:A12
+        13    ICD9:V57.89
+        dtype: category
+        Categories (3, object): [...ICD9:432.1..., ...ICD10:A12..., ...ICD9:V57.89...]
+        >>> codes.hits, codes.misses, len(codes)
+        (0, 3, 3)
+
+    Pairs seen in earlier chunks are hits; the cache is bounded by
+    evicting the least recently used pairs::
+
+        >>> codes.dx_codes(dx.vrsn[:2], dx.cd[:2]).tolist()
+        ['ICD9:432.1', 'ICD9:432.1']
+        >>> codes.dx_codes(pd.Series(['9']), pd.Series(['250'])).tolist()
+        ['ICD9:250']
+        >>> codes.hits, codes.misses, len(codes)
+        (1, 4, 3)
+    '''
+    def __init__(self, capacity: int=100000) -> None:
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()  # type: Dict[Tuple[str, Any, Any], str]
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def dx_codes(self, dgns_vrsn: pd.Series, dgns_cd: pd.Series) -> pd.Series:
+        '''Memoized `fmt_dx_codes`.
+        '''
+        return self._format('DX', lambda vrsn, cd: fmt_dx_codes(vrsn, cd),
+                            dgns_vrsn, dgns_cd)
+
+    def px_codes(self, prcdr_cd: pd.Series, prcdr_vrsn: pd.Series) -> pd.Series:
+        '''Memoized `fmt_px_codes`.
+        '''
+        return self._format('PX', lambda vrsn, cd: fmt_px_codes(cd, vrsn),
+                            prcdr_vrsn, prcdr_cd)
+
+    def _format(self, kind: str, fmt: Callable[[pd.Series, pd.Series], pd.Series],
+                vrsn: pd.Series, cd: pd.Series) -> pd.Series:
+        pair_ix, vrsn_u, cd_u = _factorize_pairs(vrsn, cd)
+        keys = [(kind, v, c) for v, c in zip(vrsn_u, cd_u)]
+        found = np.array([self._cache.get(k) for k in keys], dtype=object)
+        fresh = [ix for ix, key in enumerate(keys) if found[ix] is None]
+        self.hits += len(keys) - len(fresh)
+        self.misses += len(fresh)
+        if fresh:
+            found[fresh] = fmt(pd.Series(vrsn_u[fresh]), pd.Series(cd_u[fresh])).values
+        for key, concept_cd in zip(keys, found):
+            self._cache[key] = concept_cd
+            self._cache.move_to_end(key)
+        while len(self._cache) > self.capacity:
+            self._cache.popitem(last=False)
+        # Distinct pairs may format alike, e.g. ICD9 codes with null and '9' versions.
+        concept_ix, concept_u = pd.factorize(found)
+        return pd.Series(pd.Categorical.from_codes(concept_ix[pair_ix], concept_u), index=cd.index)
+
+
+def _factorize_pairs(a: pd.Series, b: pd.Series) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''Factorize pairs (a[i], b[i]); nulls in a are factorized as None.
+
+    :return: codes, a_uniques, b_uniques
+    '''
+    a_ix, a_u = pd.factorize(a)
+    b_ix, b_u = pd.factorize(b)
+    width = len(b_u) + 1
+    pair_ix, pair_u = pd.factorize((a_ix + 1) * width + (b_ix + 1))
+    a_u = np.array([None] + list(a_u), dtype=object)
+    b_u = np.array([None] + list(b_u), dtype=object)
+    return pair_ix, a_u[pair_u // width], b_u[pair_u % width]
+
+
+fact_codes = ['concept_cd', 'modifier_cd', 'valtype_cd', 'provider_id', 'sourcesystem_cd']
+
+
+def _constant(value: str, qty: int) -> pd.Categorical:
+    """A code repeated `qty` times, stored once.
+    """
+    return pd.Categorical.from_codes(np.zeros(qty, dtype=np.int8), [value])
+
+
+def _as_codes(col: pd.Series, missing: str) -> pd.Series:
+    """Store a column of codes as a categorical, with `missing` for nulls.
+
+    >>> _as_codes(pd.Series(['1234', None, '1234']), '@').tolist()
+    ['1234', '@', '1234']
+    """
+    if col.dtype.name != 'category':
+        col = col.astype('category')
+    if missing not in col.cat.categories:
+        col = col.cat.add_categories([missing])
+    return col.fillna(missing)
+
+
+def _append_facts(a: pd.DataFrame, b: pd.DataFrame) -> pd.DataFrame:
+    """Append facts, keeping codes categorical over the union of their categories.
+
+    The code columns of `a` and `b` are re-categorized in place, rather
+    than copying both frames first.
+
+    >>> a = pd.DataFrame(dict(concept_cd=_constant('DX:1', 2)))
+    >>> b = pd.DataFrame(dict(concept_cd=pd.Categorical(['PX:2', 'DX:1'])))
+    >>> _append_facts(a, b).concept_cd.tolist()
+    ['DX:1', 'DX:1', 'PX:2', 'DX:1']
+    >>> _append_facts(a, b).concept_cd.dtype.name
+    'category'
+    """
+    for name in fact_codes:
+        if name in a.columns and name in b.columns:
+            union = _no_dups(list(a[name].astype('category').cat.categories) +
+                             list(b[name].astype('category').cat.categories))
+            a[name] = a[name].astype('category').cat.set_categories(union)
+            b[name] = b[name].astype('category').cat.set_categories(union)
+    return a.append(b)
+
+
+# facts (if any), pct_in, source rows, last src_ix
+_MappedChunk = Tuple[Opt[pd.DataFrame], float, int, int]
+# RowStream progress as of one fetch
+_Fetch = NamedTuple('_Fetch', [('fetch_round_trips', int), ('arraysize', int), ('fetch_bytes', int)])
+
+
 class CMSRIFUpload(MedparMapped, CMSVariables):
     bene_id_first = IntParam()
     bene_id_last = IntParam()
@@ -844,9 +1186,35 @@ class CMSRIFUpload(MedparMapped, CMSVariables):
     group_qty = IntParam(significant=False, default=-1)
 
     chunk_size = IntParam(default=10000, significant=False)
+    adapt_chunk_size = BoolParam(default=False, significant=False,
+                                 description='tune chunk_size from facts per row, memory, and insert rate')
+    chunk_mb_max = IntParam(default=1000, significant=False,
+                            description='adapt_chunk_size: memory ceiling for a chunk of facts')
+    resident_mb_max = IntParam(default=0, significant=False,
+                               description='adapt_chunk_size: memory ceiling for the process; 0 for none')
+    code_cache_size = IntParam(default=100000, significant=False,
+                               description='distinct (version, code) pairs to remember across chunks')
+    parallel_pivot = IntParam(default=1, significant=False,
+                              description='worker processes to pivot chunks of this upload')
+    keyset_rows = IntParam(default=0, significant=False,
+                           description='number source rows by bene_id, in sub-ranges of about this many; 0 for rownum')
+    keyset_fetchers = IntParam(default=1, significant=False,
+                               description='keyset_rows: sub-ranges to fetch at once, each on its own session')
+    rowcount_estimate = StrParam(default='survey', significant=False,
+                                 description='survey, plan, or count: how to size up a chunk for progress')
+    est_facts = IntParam(default=0, significant=False,
+                         description='estimated facts, for scheduling; see _BeneIdGrouped')
+    fact_units = IntParam(default=0, significant=False,
+                          description='claim a unit of the cms_facts resource per this many est_facts; 0 for none')
     # label doesn't overlap with RIF columns
     src_ix = sqla.literal_column('rownum', type_=sqla.types.Integer).label('src_ix')
     chunk_rowcount = 1  # updated to useful value in `chunks()` method
+    chunk_rowcount_by = 'count'
+    _sizer = None  # type: Opt[ChunkSizer]
+    _chunk_rows_in = 0  # source rows behind the chunk of facts `obs_data` last yielded
+    _chunk_ix_last = None  # type: Opt[int]  # last src_ix behind it
+    _rows_in_total = 0
+    _resume = None  # type: Opt[Checkpoint]
 
     table_name = 'PLACEHOLDER'
 
@@ -863,17 +1231,60 @@ class CMSRIFUpload(MedparMapped, CMSVariables):
     def input_label(self) -> str:
         return self.qualified_name()
 
+    @property
+    def priority(self) -> int:  # type: ignore
+        '''Start the biggest chunks first, so they don't stretch the tail.
+        '''
+        return self.est_facts
+
+    @property
+    def resources(self) -> Dict[str, int]:  # type: ignore
+        '''Claim `cms_facts` in proportion to estimated facts, if `fact_units` says to.
+
+        luigi never runs a task that claims more of a resource than the
+        [resources] config section provides (1 if not given), so we claim
+        no more than that; the biggest tasks then run alone.
+        '''
+        if not (self.fact_units and self.est_facts):
+            return {}
+        claim = -(-self.est_facts // self.fact_units)
+        total = luigi.configuration.get_config().getint('resources', 'cms_facts', 1)
+        return {'cms_facts': max(min(claim, total), 1)}
+
+    def __getstate__(self) -> Dict[str, Any]:
+        '''Leave out callbacks that the luigi worker sets on the task
+        (e.g. `set_status_message`), so pivot workers can get a copy.
+        '''
+        return {k: v for k, v in self.__dict__.items() if not callable(v)}
+
     def qualified_name(self, name: Opt[str] = None) -> str:
         return '%s.%s' % (self.source.cms_rif, name or self.table_name)
 
     def table_info(self, lc: LoggedConnection) -> sqla.MetaData:
         return self.source.table_details(lc, [self.table_name])
 
-    def source_query(self, meta: sqla.MetaData) -> sqla.sql.expression.Select:
-        # ISSUE: order_by(t.c.bene_id)?
+    def source_query(self, meta: sqla.MetaData,
+                     key_range: Opt[KeyRange]=None) -> sqla.sql.expression.Select:
         t = meta.tables[self.qualified_name()].alias('rif')
-        return (sqla.select([self.src_ix] + self.active_source_cols(t))  # type: ignore
-                .where(t.c.bene_id.between(self.bene_id_first, self.bene_id_last)))
+        return (sqla.select([self.source_ix(t, key_range)] + self.active_source_cols(t))  # type: ignore
+                .where(self.bene_range(t, key_range)))
+
+    def source_ix(self, t: sqla.sql.expression.Alias,
+                  key_range: Opt[KeyRange]=None) -> sqla.sql.expression.ColumnElement:
+        '''`rownum`, in no particular order, or, given a `key_range`,
+        row number by bene_id and rowid after `key_range.offset`.
+        '''
+        if key_range is None:
+            return self.src_ix
+        rowid = sqla.literal_column('%s.rowid' % t.name)
+        return (sqla.func.row_number().over(order_by=[t.c.bene_id, rowid]) +
+                key_range.offset).label(self.src_ix.name)
+
+    def bene_range(self, t: sqla.sql.expression.Alias,
+                   key_range: Opt[KeyRange]=None) -> sqla.sql.expression.ColumnElement:
+        if key_range is None:
+            return t.c.bene_id.between(self.bene_id_first, self.bene_id_last)
+        return t.c.bene_id.between(key_range.key_lo, key_range.key_hi)
 
     @classmethod
     def active_source_cols(cls, t: sqla.Table) -> List[sqla.Column]:
@@ -882,13 +1293,47 @@ class CMSRIFUpload(MedparMapped, CMSVariables):
 
     @classmethod
     def active_col_data(cls) -> pd.DataFrame:
+        return cls.registry().derived(('active_col_data', cls), cls._active_col_data).copy()
+
+    @classmethod
+    def _active_col_data(cls) -> pd.DataFrame:
         info = CMSVariables.active_columns(
-            cls.table_name, extras=cls.i2b2_map.values())
+            cls.table_name, extras=cls.i2b2_map.values()).copy()
         info.column_name = info.column_name.str.lower()
         return info
 
+    @classmethod
+    def facts_per_row(cls) -> int:
+        '''Most facts one source row can make: one per active column,
+        except those that say who, when, etc. (`i2b2_map`) and
+        diagnosis / procedure versions etc., which go with codes.
+
+        >>> CarrierClaimUpload.facts_per_row(), MBSFUpload.facts_per_row()
+        (19, 12)
+        '''
+        info = cls.active_col_data()
+        simple = info[info.dxpx.isnull() & ~info.column_name.isin(list(cls.i2b2_map.values()))]
+        codes = info[info.dxpx.fillna('').str.endswith('_CD')]
+        return max(len(simple) + len(codes), 1)
+
+    @classmethod
+    def valtype_groups(cls, col_info: pd.DataFrame) -> List[Tuple[Valtype, List[Tuple[str, str]]]]:
+        '''Group columns by valtype, along with their concept code prefixes.
+
+        >>> _rif, _info, simple_cols = _RIFTestData.build(MEDPAR_Upload)
+        >>> [(v.name, len(cols)) for v, cols in MEDPAR_Upload.valtype_groups(simple_cols)]
+        [('coded', 31), ('text', 2), ('date', 4), ('numeric', 34)]
+        >>> MEDPAR_Upload.valtype_groups(simple_cols) is MEDPAR_Upload.valtype_groups(simple_cols)
+        True
+        '''
+        key = ('valtype_groups', cls, _column_key(col_info))
+        return cls.registry().derived(key, lambda: [
+            (valtype, [(column, cls._concept_prefix(column))
+                       for column in col_info[col_info.valtype_cd == valtype.value].column_name])
+            for valtype in Valtype])
+
     def chunks(self, lc: LoggedConnection,
-               chunk_size: int=1000) -> pd.DataFrame:
+               chunk_size: int=1000, sizer: Opt[ChunkSizer]=None) -> RowStream:
         '''Get data from `source_query` in chunks.
 
         .. note:: Here we use "chunk" in the pandas sense of
@@ -896,15 +1341,103 @@ class CMSRIFUpload(MedparMapped, CMSVariables):
                   we're breaking up covers a "chunk" in the sense
                   of breaking up the CMS RIF data into
                   chunks of beneficiaries.
+
+        :param sizer: if given, fetch `sizer.rows` rows at a time,
+                      as of each fetch, rather than `chunk_size`.
+        :return: a stream of DataFrames, which counts round trips and bytes
         '''
         params = dict(bene_id_first=self.bene_id_first,
                       bene_id_last=self.bene_id_last)
         meta = self.table_info(lc)
         q = self.source_query(meta)
-        log_plan(lc, event='get chunk', query=q, params=params)
-        # How many rows for this whole chunk of beneficiaries?
-        self.chunk_rowcount = lc.scalar(sqla.select([sqla.func.count()]).select_from(q))
-        return pd.read_sql(q, lc._conn, params=params, chunksize=chunk_size)
+        plan = log_plan(lc, event='get chunk', query=q, params=params,
+                        schema_digest=str(table_digest(meta)))
+        self.chunk_rowcount, self.chunk_rowcount_by = self.estimate_rowcount(lc, q, plan)
+        return RowStream(lc._conn, q, params,
+                         size=(lambda: sizer.rows) if sizer is not None else (lambda: chunk_size))
+
+    def keyset_chunks(self, lc: LoggedConnection) -> Iterator[Tuple[pd.DataFrame, _Fetch]]:
+        '''Get data from `source_query` a `KeyRange` at a time, in `src_ix` order.
+
+        Each row gets the same `src_ix` on every run, so a resumed
+        upload can continue from any position, and sub-ranges can be
+        fetched `keyset_fetchers` at a time.
+        '''
+        meta = self.table_info(lc)
+        ranges = self.keyset_ranges(lc, meta)
+        self.chunk_rowcount, self.chunk_rowcount_by = max(sum(r.rows for r in ranges), 1), 'keyset'
+        if ranges:
+            log_plan(lc, event='get chunk', query=self.range_query(meta, ranges[0]), params={},
+                     schema_digest=str(table_digest(meta)))
+        position = self._resume.source_position if self._resume else 0
+        ranges = [r for r in ranges if r.offset + r.rows > position]
+        sizer = self._sizer
+        size = (lambda: sizer.rows) if sizer is not None else (lambda: self.chunk_size)
+
+        def fetch(conn: sqla.engine.Connection, r: KeyRange) -> Iterator[Tuple[pd.DataFrame, _Fetch]]:
+            stream = RowStream(conn, self.range_query(meta, r, position), {}, size=size)
+            for data in stream:
+                yield data, _Fetch(stream.fetch_round_trips, stream.arraysize, stream.fetch_bytes)
+
+        if self.keyset_fetchers <= 1:
+            return (chunk for r in ranges for chunk in fetch(lc._conn, r))
+
+        def fetch_all(r: KeyRange) -> List[Tuple[pd.DataFrame, _Fetch]]:
+            with self.connection('fetch %s..%s' % (r.key_lo, r.key_hi)) as range_lc:
+                return list(fetch(range_lc._conn, r))
+
+        return (chunk
+                for chunks in fetch_in_order(ranges, fetch_all, self.keyset_fetchers)
+                for chunk in chunks)
+
+    def keyset_ranges(self, lc: LoggedConnection, meta: sqla.MetaData) -> List[KeyRange]:
+        '''Split this chunk of beneficiaries into sub-ranges of about `keyset_rows` rows.
+        '''
+        t = meta.tables[self.qualified_name()]
+        q = (sqla.select([t.c.bene_id, sqla.func.count()])
+             .where(t.c.bene_id.between(self.bene_id_first, self.bene_id_last))
+             .group_by(t.c.bene_id)
+             .order_by(t.c.bene_id))
+        with lc.log.step('%(event)s of about %(keyset_rows)d rows in %(source_table)s',
+                         dict(event='keyset ranges', keyset_rows=self.keyset_rows,
+                              source_table=self.qualified_name())) as step:
+            ranges = key_ranges([(key, int(qty)) for key, qty in lc.execute(q).fetchall()],
+                                self.keyset_rows)
+            step.argobj.update(range_qty=len(ranges))
+            step.msg_parts.append(': %(range_qty)d')
+        return ranges
+
+    def range_query(self, meta: sqla.MetaData, key_range: KeyRange,
+                    position: int=0) -> sqla.sql.expression.Select:
+        '''Select rows in `key_range` after `position`, in `src_ix` order.
+        '''
+        q = self.source_query(meta, key_range)
+        if position > key_range.offset:
+            src = q.alias('src')
+            q = sqla.select([src]).where(src.c[self.src_ix.name] > position)
+        return q.order_by(self.src_ix.name)
+
+    def estimate_rowcount(self, lc: LoggedConnection, q: sqla.sql.expression.Select,
+                          plan: List[str]) -> Tuple[int, str]:
+        '''How many rows for this whole chunk of beneficiaries?
+
+        Rather than scan the source table an extra time with count(*),
+        use `BeneIdSurvey` row counts or else the optimizer's estimate
+        from the `plan`, depending on `rowcount_estimate`.
+
+        :return: row count and how we got it
+        '''
+        ways = ['survey', 'plan', 'count']
+        if self.rowcount_estimate not in ways:
+            raise ValueError('rowcount_estimate %s not in %s' % (self.rowcount_estimate, ways))
+        for by in ways[ways.index(self.rowcount_estimate):]:
+            qty = (BeneIdSurvey.range_rows(lc, self.table_name, self.bene_id_first, self.bene_id_last)
+                   if by == 'survey' else
+                   plan_rows(plan) if by == 'plan' else
+                   lc.scalar(sqla.select([sqla.func.count()]).select_from(q)))
+            if qty is not None:
+                break
+        return max(qty, 1), by
 
     def column_data(self, lc: LoggedConnection) -> pd.DataFrame:
         meta = self.table_info(lc)
@@ -918,8 +1451,6 @@ class CMSRIFUpload(MedparMapped, CMSVariables):
 
     def obs_data(self, lc: LoggedConnection, upload_id: int) -> Iterator[Tuple[pd.DataFrame, float]]:
         cols = self.column_properties(self.column_data(lc))
-        chunks = self.chunks(lc, chunk_size=self.chunk_size)
-        subtot_in = 0
 
         bene_range = (self.bene_id_first, self.bene_id_last)
         with lc.log.step('%(event)s %(bene_range)s',
@@ -932,47 +1463,152 @@ class CMSRIFUpload(MedparMapped, CMSVariables):
             map_step.msg_parts.append(' emap: %(emap_len)d')
 
         [fact_t] = self.project.table_details(lc, ['observation_fact']).tables.values()
+        self._sizer = self.chunk_sizer()
+        if self.pipeline_depth > 0 or self.parallel_pivot > 1:
+            mapped_chunks = self._pipelined(upload_id, cols, pmap, emap)
+        else:
+            mapped_chunks = self._sequential(lc, upload_id, cols, pmap, emap)
+        self._rows_in_total = self._resume.rows_in if self._resume else 0
+        for mapped, pct_in, rows_in, ix_last in mapped_chunks:
+            self._rows_in_total += rows_in
+            self._chunk_ix_last = ix_last
+            if mapped is None:
+                continue
+            self._chunk_rows_in = rows_in
+            yield self.with_admin(mapped, upload_id, lc, fact_t), pct_in
+
+    def can_resume(self) -> bool:
+        '''Only with `keyset_rows`; `rownum` order can change from one run to the next.
+        '''
+        return self.keyset_rows > 0
+
+    def checkpoint_position(self) -> Opt[Tuple[int, int]]:
+        if self._chunk_ix_last is None or not self.can_resume():
+            return None
+        return self._chunk_ix_last, self._rows_in_total
+
+    def resume_after(self, lc: LoggedConnection, fact_table: sqla.Table, checkpoint: Checkpoint) -> int:
+        self._resume = checkpoint
+        # instance_num is src_ix * 10 ** max_cols_digits (+ group); see pivot_valtype
+        after = (checkpoint.source_position + 1) * 10 ** CMSVariables.max_cols_digits
+        return lc.execute(fact_table.delete().where(fact_table.c.instance_num >= after)).rowcount
+
+    def chunk_sizer(self) -> Opt[ChunkSizer]:
+        if not self.adapt_chunk_size:
+            return None
+        return ChunkSizer(self.chunk_size, lo=max(self.chunk_size // 16, 1), hi=self.chunk_size * 16,
+                          fact_mb_max=self.chunk_mb_max, resident_mb_max=self.resident_mb_max)
+
+    def chunk_loaded(self, lc: LoggedConnection, facts: pd.DataFrame,
+                     fact_bytes: float, insert_sec: float) -> None:
+        if self._sizer is None:
+            return
+        change = self._sizer.observe(self._chunk_rows_in, len(facts), fact_bytes, insert_sec,
+                                     resident_mb=resident_mb())
+        if change is not None:
+            old_rows, new_rows, reason = change
+            lc.log.info('%(event)s %(old_rows)d -> %(new_rows)d rows: %(reason)s',
+                        dict(event='chunk size', old_rows=old_rows, new_rows=new_rows, reason=reason,
+                             source_table=self.qualified_name()))
+
+    def _sequential(self, lc: LoggedConnection, upload_id: int, cols: pd.DataFrame,
+                    pmap: pd.DataFrame, emap: pd.DataFrame) -> Iterator[_MappedChunk]:
+        codes = ConceptCodeCache(self.code_cache_size)
+        for data, pct_in in self._select(lc, upload_id):
+            mapped = self.transform(lc.log, data, cols, codes, pmap, emap)
+            yield mapped, pct_in, len(data), int(data.index.max())
+
+    def _pipelined(self, upload_id: int, cols: pd.DataFrame,
+                   pmap: pd.DataFrame, emap: pd.DataFrame) -> Iterator[_MappedChunk]:
+        """Overlap fetch, pivot, and (our caller's) insert.
+
+        A thread fetches chunks ahead on its own connection while
+        `parallel_pivot` worker processes pivot and map them.
+
+        By now this process has threads (luigi's, our read-ahead
+        thread) and locks held by them (e.g. in logging handlers), so
+        rather than fork it, workers start from a `forkserver` process.
+        Each gets the task, mappings, and column info pickled once,
+        in `_pivot_init`, rather than per chunk. Workers send facts
+        back as numpy arrays (see `_frame_buffers`).
+        """
+        workers = max(self.parallel_pivot, 1)
+        depth = max(self.pipeline_depth, workers)
+
+        def fetch() -> Iterator[Tuple[pd.DataFrame, float]]:
+            with self.connection('fetch chunks') as fetch_lc:
+                for data_pct in self._select(fetch_lc, upload_id):
+                    yield data_pct
+
+        ctx = multiprocessing.get_context('forkserver')
+        ctx.set_forkserver_preload([__name__])
+        pool = ctx.Pool(workers, _pivot_init, (self, cols, pmap, emap, logging.getLogger().level))
+        try:
+            pending = deque()  # type: deque
+            for data, pct_in in _read_ahead(fetch, depth):
+                pending.append((pool.apply_async(_pivot_chunk, (data,)), pct_in, len(data),
+                                int(data.index.max())))
+                if len(pending) >= depth:
+                    yield _ready(*pending.popleft())
+            while pending:
+                yield _ready(*pending.popleft())
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _select(self, lc: LoggedConnection, upload_id: int) -> Iterator[Tuple[pd.DataFrame, float]]:
+        if self.keyset_rows > 0:
+            chunks = self.keyset_chunks(lc)
+        else:
+            stream = self.chunks(lc, chunk_size=self.chunk_size, sizer=self._sizer)
+            chunks = ((data, stream) for data in stream)
+        subtot_in = self._resume.rows_in if self._resume else 0
         while 1:
             with lc.log.step('UP#%(upload_id)d: %(event)s from %(source_table)s',
                              dict(event='select', upload_id=upload_id,
                                   source_table=self.qualified_name())) as s1:
                 try:
-                    data = next(chunks).set_index(self.src_ix.name)
+                    data, fetched = next(chunks)
                 except StopIteration:
                     break
+                data = data.set_index(self.src_ix.name)
                 subtot_in, pct_in = self._input_progress(data, subtot_in, s1)
-
-            obs, simple_cols = self.custom_obs(lc, data, cols)
-
-            with lc.log.step('%(event)s from %(records)d %(source_table)s records',
-                             dict(event='pivot facts', records=len(data),
-                                  source_table=self.qualified_name())) as pivot_step:
-                for valtype in Valtype:
-                    obs_v = self.pivot_valtype(valtype, data, self.table_name, simple_cols)
-                    if len(obs_v) > 0:
-                        obs = obs_v if obs is None else obs.append(obs_v)
-                if obs is None:
-                    continue
-                pivot_step.argobj.update(dict(obs_len=len(obs)))
-                pivot_step.msg_parts.append(' %(obs_len)d total observations')
-
-                mapped = self.with_mapping(obs, pmap, emap)
-                lc.log.info('after mapping by %s: %d',
-                            'medpar_id' if 'medpar_id' in obs.columns.values else 'bene_id and start_date',
-                            len(mapped))
-            obs_fact = self.with_admin(mapped, upload_id, lc, fact_t)
-
-            yield obs_fact, pct_in
+                _fetch_progress(fetched, s1)
+            yield data, pct_in
+
+    def transform(self, log: EventLogger, data: pd.DataFrame, cols: pd.DataFrame,
+                  codes: ConceptCodeCache,
+                  pmap: pd.DataFrame, emap: pd.DataFrame) -> Opt[pd.DataFrame]:
+        obs, simple_cols = self.custom_obs(log, data, cols, codes)
+
+        with log.step('%(event)s from %(records)d %(source_table)s records',
+                      dict(event='pivot facts', records=len(data),
+                           source_table=self.qualified_name())) as pivot_step:
+            obs_v = self.pivot_facts(data, self.table_name, simple_cols)
+            if len(obs_v) > 0:
+                obs = obs_v if obs is None else _append_facts(obs, obs_v)
+            if obs is None:
+                return None
+            pivot_step.argobj.update(dict(obs_len=len(obs)))
+            pivot_step.msg_parts.append(' %(obs_len)d total observations')
+
+            mapped = self.with_mapping(obs, pmap, emap)
+            log.info('after mapping by %s: %d',
+                     'medpar_id' if 'medpar_id' in obs.columns.values else 'bene_id and start_date',
+                     len(mapped))
+        return mapped
 
     def _input_progress(self, data: pd.DataFrame,
                         subtot_in: int,
                         s1: LogState) -> Tuple[int, float]:
         subtot_in += len(data)
         pct_in = 100.0 * subtot_in / self.chunk_rowcount
+        if self.chunk_rowcount_by not in ['count', 'keyset']:
+            pct_in = min(pct_in, 99.9)  # Estimates can run low; we're not done until we're done.
         s1.argobj.update(rows_in=len(data), subtot_in=subtot_in, pct_in=pct_in,
-                         chunk_rowcount=self.chunk_rowcount)
+                         chunk_rowcount=self.chunk_rowcount, rowcount_by=self.chunk_rowcount_by)
         s1.msg_parts.append(
-            ' + %(rows_in)d rows = %(subtot_in)d (%(pct_in)0.2f%%) of %(chunk_rowcount)d')
+            ' + %(rows_in)d rows = %(subtot_in)d (%(pct_in)0.2f%%) of %(chunk_rowcount)d by %(rowcount_by)s')
         return subtot_in, pct_in
 
     @classmethod
@@ -989,8 +1625,9 @@ class CMSRIFUpload(MedparMapped, CMSVariables):
 
         return out
 
-    def custom_obs(self, lc: LoggedConnection,
-                   data: pd.DataFrame, cols: pd.DataFrame) -> Tuple[Opt[pd.DataFrame], pd.DataFrame]:
+    def custom_obs(self, log: EventLogger,
+                   data: pd.DataFrame, cols: pd.DataFrame,
+                   codes: ConceptCodeCache) -> Tuple[Opt[pd.DataFrame], pd.DataFrame]:
         return None, cols
 
     @classmethod
@@ -1055,6 +1692,163 @@ class CMSRIFUpload(MedparMapped, CMSVariables):
 
         return obs
 
+    @classmethod
+    def pivot_facts(cls, rif_data: pd.DataFrame,
+                    table_name: str, col_info: pd.DataFrame) -> pd.DataFrame:
+        '''Unpivot columns of all valtypes from (wide) rif_data to (long) i2b2 facts in one pass.
+
+        Rather than melting (and copying) rif_data once per valtype,
+        we gather the non-null cells of each column by row index and
+        fill a single output frame, valtype by valtype, column by column.
+
+        The result matches `pivot_valtype` for each valtype in turn::
+
+            >>> rif_data, col_info, simple_cols = _RIFTestData.build(MEDPAR_Upload)
+            >>> obs = MEDPAR_Upload.pivot_facts(rif_data, MEDPAR_Upload.table_name, simple_cols)
+            >>> len(obs)
+            355
+            >>> by_valtype = pd.concat([
+            ...     MEDPAR_Upload.pivot_valtype(v, rif_data, MEDPAR_Upload.table_name, simple_cols)
+            ...     for v in Valtype]).reset_index(drop=True)
+            >>> fact_cols = ['bene_id', 'medpar_id', 'instance_num', 'modifier_cd', 'valtype_cd',
+            ...              'concept_cd', 'tval_char',
+            ...              'start_date', 'end_date', 'update_date', 'provider_id']
+            >>> (by_valtype[fact_cols].fillna('-') == obs[fact_cols].fillna('-')).all().all()
+            True
+
+        Numeric values are stored as floats::
+
+            >>> (by_valtype.nval_num.astype(float).fillna(0) == obs.nval_num.fillna(0)).all()
+            True
+
+        Concept code prefixes are computed (and interned) once per column::
+
+            >>> obs.concept_cd[obs.valtype_cd == 'N'].iloc[0] is obs.concept_cd[
+            ...     obs.valtype_cd == 'N'].iloc[1]
+            True
+        '''
+        id_vars = _no_dups([cls.i2b2_map[v] for v in cls.obs_id_vars if v in cls.i2b2_map])
+        spare_digits = CMSVariables.max_cols_digits
+
+        # Gather row indexes of non-null cells, column by column, grouped by valtype.
+        prefixes = []  # type: List[str]
+        row_ixs = []  # type: List[np.ndarray]
+        segments = []  # type: List[Tuple[Valtype, int, int, np.ndarray]]
+        hi = 0
+        for valtype, columns in cls.valtype_groups(col_info):
+            lo = hi
+            values = []  # type: List[np.ndarray]
+            for column, prefix in columns:
+                col_values = rif_data[column].values
+                row_ix = np.flatnonzero(pd.notnull(col_values))
+                prefixes.append(prefix)
+                row_ixs.append(row_ix)
+                values.append(col_values[row_ix])
+                hi += len(row_ix)
+            if hi > lo:
+                segments.append((valtype, lo, hi, np.concatenate(values)))
+
+        qty = hi
+        row_ix = np.concatenate(row_ixs) if row_ixs else np.array([], dtype=int)
+        col_ix = np.repeat(np.arange(len(row_ixs)), [len(ix) for ix in row_ixs])
+
+        out = OrderedDict()  # type: Dict[str, np.ndarray]
+        for v in id_vars:
+            out[v] = rif_data[v].values[row_ix]
+        out['instance_num'] = rif_data.index.values[row_ix] * (10 ** spare_digits)
+
+        # i2b2 numeric (and text?) constraint searches only match modifier_cd = '@'
+        # so only use rif_modifer() on coded values.
+        out['modifier_cd'] = _constant('@', qty)
+        valtype_ix = np.zeros(qty, dtype=np.int8)
+        concept_cd = np.array(prefixes, dtype=object)[col_ix]
+        tval_char = np.full(qty, None, dtype=object)  # avoid NaN, which causes sqlalchemy to choke
+        nval_num = np.full(qty, np.nan)
+        start_date = cls._mapped_values(rif_data, 'start_date', row_ix)
+        end_date = cls._mapped_values(rif_data, 'end_date', row_ix)
+
+        V = Valtype
+        valtypes = list(Valtype)
+        for valtype, lo, hi, value in segments:
+            valtype_ix[lo:hi] = valtypes.index(valtype)
+            if valtype == V.coded:
+                concept_cd[lo:hi] = concept_cd[lo:hi] + value
+            elif valtype == V.numeric:
+                nval_num[lo:hi] = value
+                tval_char[lo:hi] = NumericOp.eq.value
+            elif valtype == V.text:
+                tval_char[lo:hi] = value
+            elif valtype == V.date:
+                tval_char[lo:hi] = pd.Series(value).astype('<U').values  # format yyyy-mm-dd...
+                start_date = _splice(start_date, lo, hi, value)
+                end_date = _splice(end_date, lo, hi, value)
+            else:
+                raise TypeError(valtype)
+
+        out['valtype_cd'] = pd.Categorical.from_codes(valtype_ix, [v.value for v in valtypes])
+        out['concept_cd'] = pd.Categorical(concept_cd)
+        out['tval_char'] = tval_char
+        out['nval_num'] = nval_num
+        out['start_date'] = start_date
+        out['end_date'] = end_date
+        out['update_date'] = rif_data[cls.i2b2_map['update_date']].values[row_ix]
+        for c in ['provider_id', 'quantity_num', 'confidence_num']:
+            if c in cls.i2b2_map:
+                out[c] = rif_data[cls.i2b2_map[c]].values[row_ix]
+
+        return pd.DataFrame(out, columns=list(out.keys()))
+
+    @classmethod
+    def _concept_prefix(cls, column: str) -> str:
+        scheme = cls.concept_scheme_override.get(column, column)
+        return intern(scheme.upper() + ':')
+
+    @classmethod
+    def _mapped_values(cls, rif_data: pd.DataFrame, i2b2_col: str,
+                       row_ix: np.ndarray) -> np.ndarray:
+        if i2b2_col in cls.i2b2_map:
+            return rif_data[cls.i2b2_map[i2b2_col]].values[row_ix]
+        return np.full(len(row_ix), np.nan, dtype=object)
+
+
+def _fetch_progress(stream: Union[RowStream, _Fetch], step: LogState) -> None:
+    step.argobj.update(round_trips=stream.fetch_round_trips, arraysize=stream.arraysize,
+                       fetch_mb=stream.fetch_bytes / 1e6)
+    step.msg_parts.append(' in %(round_trips)d round trips of %(arraysize)d, %(fetch_mb)0.1fMB')
+
+
+def _column_key(cols: pd.DataFrame) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    '''Key column info by names and valtypes (with NaN as '', lest NaN != NaN spoil lookups).
+    '''
+    return tuple(cols.column_name), tuple(cols.valtype_cd.fillna(''))
+
+
+def _splice(base: np.ndarray, lo: int, hi: int, values: np.ndarray) -> np.ndarray:
+    '''Replace base[lo:hi] with values, upcasting to object if dtypes differ.
+
+    Upcasting goes through pandas, since numpy turns datetime64[ns]
+    into int nanoseconds rather than timestamps:
+
+    >>> start_date = np.array(['2015-01-01'] * 3, dtype='datetime64[ns]')
+    >>> list(_splice(start_date, 1, 2, np.array(['1999-12-31'], dtype=object)))
+    [Timestamp('2015-01-01 00:00:00'), '1999-12-31', Timestamp('2015-01-01 00:00:00')]
+    >>> _splice(start_date, 0, 1, np.array(['2001-02-03'], dtype='datetime64[D]'))[:2]
+    ... # doctest: +NORMALIZE_WHITESPACE
+    array(['2001-02-03T00:00:00.000000000', '2015-01-01T00:00:00.000000000'],
+          dtype='datetime64[ns]')
+    '''
+    if base.dtype != values.dtype:
+        if base.dtype.kind == 'M' and values.dtype.kind == 'M':
+            values = values.astype(base.dtype)
+        else:
+            base, values = _as_objects(base), _as_objects(values)
+    base[lo:hi] = values
+    return base
+
+
+def _as_objects(values: np.ndarray) -> np.ndarray:
+    return values if values.dtype == object else pd.Series(values).astype(object).values
+
 
 def _no_dups(seq: List[T]) -> List[T]:
     from typing import Set, Callable, Any
@@ -1065,43 +1859,305 @@ def _no_dups(seq: List[T]) -> List[T]:
     Set, Callable, Any  # mute unused import warning
 
 
+def _read_ahead(items: Callable[[], Iterable[T]], depth: int) -> Iterator[T]:
+    '''Iterate over `items()` in a thread, at most `depth` items ahead.
+
+    >>> list(_read_ahead(lambda: range(5), depth=2))
+    [0, 1, 2, 3, 4]
+
+    Errors in the thread are raised to the consumer:
+
+    >>> list(_read_ahead(lambda: [1 / 0], depth=2))
+    Traceback (most recent call last):
+      ...
+    ZeroDivisionError: division by zero
+    '''
+    done = object()
+    ahead = Queue(maxsize=depth)  # type: Queue
+    stop = Event()
+
+    def put(item: object, exc: Opt[Exception]) -> bool:
+        while not stop.is_set():
+            try:
+                ahead.put((item, exc), timeout=0.5)
+                return True
+            except Full:
+                pass
+        return False
+
+    def produce() -> None:
+        try:
+            for item in items():
+                if not put(item, None):
+                    return
+        except Exception as exc:
+            put(done, exc)
+        else:
+            put(done, None)
+
+    producer = Thread(target=produce, name='read_ahead', daemon=True)
+    producer.start()
+    try:
+        while 1:
+            item, exc = ahead.get()
+            if exc is not None:
+                raise exc
+            if item is done:
+                break
+            yield cast(T, item)
+    finally:
+        stop.set()
+        producer.join()
+
+
+def first_containing(keys: np.ndarray, points: np.ndarray,
+                     interval_keys: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+    '''Find the first interval with the same key that contains each point.
+
+    :param keys: key (e.g. bene_id) of each point
+    :param points: datetime64 values
+    :param interval_keys: key of each interval
+    :param lo: interval start (inclusive)
+    :param hi: interval end (inclusive)
+    :return: position of the first such interval, in the given order,
+             or -1 where there is none
+
+    >>> day = lambda *ds: np.array(ds, dtype='datetime64[ns]')
+    >>> first_containing(np.array(['p1', 'p1', 'p1', 'p2']),
+    ...                  day('2001-01-05', '2001-01-15', '2001-02-01', '2001-01-05'),
+    ...                  np.array(['p1', 'p1', 'p1']),
+    ...                  day('2001-01-10', '2001-01-01', '2001-01-03'),
+    ...                  day('2001-01-20', '2001-01-31', '2001-01-04'))
+    array([ 1,  0, -1, -1])
+
+    Rather than compare each point with every interval of its key,
+    we sort intervals by key and start and use `searchsorted` to find
+    the last one that starts on or before each point. Then we step
+    back through earlier intervals only while a running maximum
+    of their ends says one might still contain the point.
+    '''
+    found = np.full(len(keys), -1, dtype=np.int64)
+    lo_i8, hi_i8, pt_i8 = [np.asarray(a, dtype='datetime64[ns]').view('i8')
+                           for a in [lo, hi, points]]
+    usable = np.flatnonzero(pd.notnull(interval_keys) & pd.notnull(lo) & pd.notnull(hi))
+    if len(usable) == 0:
+        return found
+    codes, _uniques = pd.factorize(np.concatenate([interval_keys[usable], keys]))
+    i_code, p_code = codes[:len(usable)], codes[len(usable):]
+
+    order = np.lexsort((lo_i8[usable], i_code))
+    i_pos = usable[order]
+    i_code = i_code[order]
+    # Combine key and start into one sortable integer using ranks of times.
+    times, rank = np.unique(np.concatenate([lo_i8[i_pos], pt_i8]), return_inverse=True)
+    width = len(times) + 1
+    i_comp = i_code.astype(np.int64) * width + rank[:len(i_pos)]
+    p_comp = p_code.astype(np.int64) * width + rank[len(i_pos):]
+    first = np.searchsorted(i_code, p_code, side='left')
+    cur = np.searchsorted(i_comp, p_comp, side='right') - 1
+    i_hi = hi_i8[i_pos]
+    hi_so_far = pd.Series(i_hi).groupby(i_code).cummax().values
+
+    todo = np.flatnonzero((p_code >= 0) & pd.notnull(points) & (cur >= first))
+    while len(todo) > 0:
+        at = cur[todo]
+        pt = pt_i8[todo]
+        todo, at, pt = [a[hi_so_far[at] >= pt] for a in [todo, at, pt]]
+        pos = i_pos[at]
+        better = (i_hi[at] >= pt) & ((found[todo] < 0) | (pos < found[todo]))
+        found[todo[better]] = pos[better]
+        cur[todo] -= 1
+        todo = todo[cur[todo] >= first[todo]]
+    return found
+
+
+FNV_OFFSET = 14695981039346656037
+FNV_PRIME = 1099511628211
+JULIAN_EPOCH = 2440588  # julian day number of 1970-01-01
+
+
+def patient_day_hash(bene_id: np.ndarray, start_date: np.ndarray) -> np.ndarray:
+    '''Hash (bene_id, day) to 63 bits, consistently across runs and with SQL.
+
+    This is 64 bit FNV-1a over the (ASCII) bytes of bene_id followed by
+    the 4 bytes, least significant first, of the julian day number of
+    start_date (0 for NaT), keeping the low 63 bits. The
+    `patient_day_hash` function in cms_keys.pls computes the same thing.
+
+    >>> patient_day_hash(np.array(['pt1', 'pt1', 'pt22']),
+    ...                  np.array(['2001-01-01', '2001-01-01T13:45', 'NaT'], dtype='datetime64[ns]'))
+    array([1875976611194951385, 1875976611194951385, 2498270758912974929])
+
+    Rather than loop over rows, we loop over byte positions, hashing
+    a column of bytes at a time.
+    '''
+    ids = np.asarray(bene_id).astype('S')
+    width = ids.dtype.itemsize
+    id_bytes = ids.view(np.uint8).reshape(len(ids), width)
+    id_len = np.char.str_len(ids)
+    days = np.asarray(start_date, dtype='datetime64[D]')
+    jdn = np.where(pd.isnull(days), 0, days.view('i8') + JULIAN_EPOCH).astype(np.uint64)
+
+    prime = np.uint64(FNV_PRIME)
+    h = np.full(len(ids), FNV_OFFSET, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for pos in range(width):
+            more = pos < id_len
+            h[more] = (h[more] ^ id_bytes[more, pos].astype(np.uint64)) * prime
+        for shift in [0, 8, 16, 24]:
+            h = (h ^ ((jdn >> np.uint64(shift)) & np.uint64(0xff))) * prime
+    return (h & np.uint64(2 ** 63 - 1)).astype(np.int64)
+
+
+# Pivot worker processes get the task, mappings etc. once, from `_pivot_init`.
+_PivotJob = Tuple[CMSRIFUpload, pd.DataFrame, pd.DataFrame, pd.DataFrame,
+                  EventLogger, ConceptCodeCache]
+_pivot_job = None  # type: Opt[_PivotJob]
+# column names, column arrays (codes, for categoricals), categories (or None), index
+_FrameBuffers = Tuple[List[str], List[np.ndarray], List[Opt[np.ndarray]], np.ndarray]
+
+
+def _pivot_init(task: CMSRIFUpload, cols: pd.DataFrame,
+                pmap: pd.DataFrame, emap: pd.DataFrame, log_level: int) -> None:
+    global _pivot_job
+    if not logging.getLogger().handlers:
+        logging.basicConfig(level=log_level)
+    _pivot_job = (task, cols, pmap, emap,
+                  EventLogger(log, task.log_info()), ConceptCodeCache(task.code_cache_size))
+
+
+def _pivot_chunk(data: pd.DataFrame) -> Opt[_FrameBuffers]:
+    if _pivot_job is None:
+        raise RuntimeError('pivot worker not initialized')
+    task, cols, pmap, emap, worker_log, codes = _pivot_job
+    mapped = task.transform(worker_log, data, cols, codes, pmap, emap)
+    return None if mapped is None else _frame_buffers(mapped)
+
+
+def _ready(result: 'multiprocessing.pool.AsyncResult', pct_in: float,
+           rows_in: int, ix_last: int) -> _MappedChunk:
+    buffers = result.get()
+    return (None if buffers is None else _buffers_frame(buffers)), pct_in, rows_in, ix_last
+
+
+def _frame_buffers(df: pd.DataFrame) -> _FrameBuffers:
+    '''Break a DataFrame into column names, column arrays, and index,
+    which pickle as flat buffers, without pandas block structure.
+
+    A categorical column goes as its codes and its categories::
+
+    >>> df = pd.DataFrame(dict(concept_cd=pd.Categorical(['DX:1', 'DX:2', 'DX:1']),
+    ...                        instance_num=[1000, 2001, 2002],
+    ...                        start_date=pd.to_datetime(['2001-01-01', None, '2001-01-02'])),
+    ...                   columns=['concept_cd', 'instance_num', 'start_date'], index=[5, 7, 8])
+    >>> names, arrays, categories, index = _frame_buffers(df)
+    >>> names
+    ['concept_cd', 'instance_num', 'start_date']
+    >>> [a.dtype.kind for a in arrays]
+    ['i', 'i', 'M']
+    >>> [None if c is None else list(c) for c in categories]
+    [['DX:1', 'DX:2'], None, None]
+    >>> back = _buffers_frame((names, arrays, categories, index))
+    >>> back.equals(df), back.concept_cd.dtype.name
+    (True, 'category')
+    '''
+    names = [str(name) for name in df.columns]
+    arrays = []  # type: List[np.ndarray]
+    categories = []  # type: List[Opt[np.ndarray]]
+    for name in names:
+        col = df[name]
+        if col.dtype.name == 'category':
+            arrays.append(col.cat.codes.values)
+            categories.append(col.cat.categories.values)
+        else:
+            arrays.append(col.values)
+            categories.append(None)
+    return names, arrays, categories, df.index.values
+
+
+def _buffers_frame(buffers: _FrameBuffers) -> pd.DataFrame:
+    names, arrays, categories, index = buffers
+    return pd.DataFrame(OrderedDict(
+        (name, values if cats is None else pd.Categorical.from_codes(values, cats))
+        for name, values, cats in zip(names, arrays, categories)),
+        index=index, columns=names)
+
+
 def obs_stack(rif_data: pd.DataFrame,
               rif_table_name: str, projections: pd.DataFrame,
               id_vars: List[str], value_vars: List[str]) -> pd.DataFrame:
-    '''
+    '''Stack groups of related columns (e.g. diagnosis code and version).
+
     :param projections: columns to project (e.g. diagnosis code and version);
                         order matches value_vars
     :param id_vars: a la pandas.melt (no dups allowed)
     :param value_vars: a la melt; data column (e.g. dgns_cd) followed by dgns_vrsn etc.
+
+    Rather than building a frame per group, we take a record x group
+    matrix for each of value_vars, flatten it group by group, and drop
+    records missing either of the first two value_vars with one mask::
+
+        >>> rif_data = pd.DataFrame([
+        ...     ['b1', '9', '4321', '10', 'A12', 'Y'],
+        ...     ['b2', '9', '1234', None, None, None],
+        ... ], columns=['bene_id', 'vrsn_1', 'cd_1', 'vrsn_2', 'cd_2', 'poa_2'], index=[7, 8])
+        >>> projections = pd.DataFrame([
+        ...     ['DGNS', 1.0, 'vrsn_1', 'cd_1', None],
+        ...     ['DGNS', 2.0, 'vrsn_2', 'cd_2', 'poa_2'],
+        ... ], columns=['mod_grp', 'ix', 'column_name_vrsn', 'column_name', 'column_name_ind']
+        ... ).set_index(['mod_grp', 'ix'])
+        >>> obs_stack(rif_data, 'T', projections, id_vars=['bene_id'],
+        ...           value_vars=['dgns_vrsn', 'dgns_cd', 'dgns_poa_ind'])
+        ... # doctest: +NORMALIZE_WHITESPACE
+                dgns_vrsn dgns_cd dgns_poa_ind  instance_num mod_grp    x
+        bene_id
+        b1              9    4321          NaN          7000    DGNS  1.0
+        b2              9    1234          NaN          8000    DGNS  1.0
+        b1             10     A12            Y          7001    DGNS  2.0
+
+    The low order digits of `instance_num` give the group number.
     '''
     assert id_vars == _no_dups(id_vars)
     assert len(projections) >= 1
 
     spare_digits = CMSVariables.max_cols_digits
+    rec_qty, grp_qty = len(rif_data), len(projections)
 
-    out = None
-    for ix, ((mod_grp, x), rif_cols) in enumerate(projections.iterrows()):
-        value_cols = list(rif_cols.dropna())
-        obs = rif_data[id_vars + value_cols].copy()
+    # value_cols is shorter than value_vars when there's no POA flag
+    value_vars = value_vars[:len(projections.columns)]
+    values = [_value_matrix(rif_data, list(projections[col])).ravel(order='F')
+              for col in projections.columns]
+    present = pd.notnull(values[0])
+    for more in values[1:2]:
+        present &= pd.notnull(more)
 
-        instance_num = obs.index * (10 ** spare_digits) + ix
-        obs = obs.set_index(id_vars)
-        # value_cols is shorter than value_vars when there's no POA flag
-        obs.columns = value_vars[:len(value_cols)]  # e.g. icd_dgns_cd11 -> dgns_cd
-        obs['instance_num'] = instance_num
+    rec_ix = np.tile(np.arange(rec_qty), grp_qty)[present]
+    grp_ix = np.repeat(np.arange(grp_qty), rec_qty)[present]
 
-        obs = obs.dropna(subset=value_vars[:2])
-        obs['mod_grp'] = mod_grp
-        obs['x'] = x
+    out = OrderedDict()  # type: Dict[str, np.ndarray]
+    for v in id_vars:
+        out[v] = rif_data[v].values[rec_ix]
+    for name, value in zip(value_vars, values):  # e.g. icd_dgns_cd11 -> dgns_cd
+        out[name] = value[present]
+    out['instance_num'] = rif_data.index.values[rec_ix] * (10 ** spare_digits) + grp_ix
+    out['mod_grp'] = projections.index.get_level_values(0).values[grp_ix]
+    out['x'] = projections.index.get_level_values(1).values[grp_ix]
 
-        if out is None:
-            out = obs
-        else:
-            out = out.append(obs)
+    return pd.DataFrame(out, columns=list(out.keys())).set_index(id_vars)
 
-    if out is None:
-        raise TypeError('no projections?')
 
+def _value_matrix(data: pd.DataFrame, cols: List[Opt[str]]) -> np.ndarray:
+    '''Get a record x group matrix of values of `cols`, which may include nulls.
+    '''
+    present = [ix for ix, col in enumerate(cols) if pd.notnull(col)]
+    block = data[[cols[ix] for ix in present]].values
+    if len(present) == len(cols):
+        return block
+    kind = block.dtype.kind
+    out = np.empty((len(data), len(cols)),
+                   dtype=block.dtype if kind in 'fMO' else object)
+    out[:] = np.datetime64('NaT') if kind == 'M' else np.nan
+    out[:, present] = block
     return out
 
 
@@ -1119,13 +2175,14 @@ class _ByExtractYear(CMSRIFUpload):
         end_date='extract_dt',    # end of year
         update_date='download_date')
 
-    def source_query(self, meta: sqla.MetaData) -> sqla.sql.expression.Select:
+    def source_query(self, meta: sqla.MetaData,
+                     key_range: Opt[KeyRange]=None) -> sqla.sql.expression.Select:
         t = meta.tables[self.qualified_name()].alias('rif')
         download_col = sqla.literal(self.source.download_date).label('download_date')
         start_date = date_trunc(t.c.extract_dt, 'year').label('start_date')
-        return (sqla.select([self.src_ix, start_date, t.c.extract_dt, download_col] +  # type: ignore
+        return (sqla.select([self.source_ix(t, key_range), start_date, t.c.extract_dt, download_col] +  # type: ignore
                             self.active_source_cols(t))
-                .where(t.c.bene_id.between(self.bene_id_first, self.bene_id_last)))
+                .where(self.bene_range(t, key_range)))
 
 
 class MBSFUpload(_ByExtractYear):
@@ -1145,6 +2202,20 @@ class MAXPSUpload(_ByExtractYear):
     max_yr_dt            NUMBER          N
     el_dob                 DATE          D
 
+    `source_query` selects `start_date` as datetime64; facts from
+    other columns keep it, alongside dates from DATE columns::
+
+    >>> rif_data, _info, simple_cols = _RIFTestData.build(MAXPSUpload)
+    >>> rif_data['start_date'] = pd.Timestamp('2015-01-01')
+    >>> rif_data['extract_dt'] = pd.Timestamp('2015-12-31')
+    >>> rif_data['download_date'] = pd.Timestamp('2016-03-01')
+    >>> facts = MAXPSUpload.pivot_facts(rif_data, MAXPSUpload.table_name, simple_cols)
+    >>> {pd.Timestamp(d) for d in facts[facts.valtype_cd != 'D'].start_date}
+    {Timestamp('2015-01-01 00:00:00')}
+    >>> {pd.Timestamp(d) for d in facts[facts.concept_cd == 'EL_DOB:'].start_date} == set(
+    ...     pd.to_datetime(rif_data.el_dob))
+    True
+
     '''
     table_name = 'maxdata_ps'
 
@@ -1197,45 +2268,65 @@ class _DxPxCombine(CMSRIFUpload):
             groups = pd.merge(groups, dt_cols, on=ix_cols, how='left', suffixes=['', suffixes[2]])
         return groups.set_index(ix_cols)
 
-    def custom_obs(self, lc: LoggedConnection,
-                   data: pd.DataFrame, cols: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
-        # curated column info
-        col_info = self.active_col_data()
-        # order col_info like db cols
-        col_info = col_info.set_index('column_name').loc[cols.column_name].reset_index()
-        dx_g = self.vrsn_cd_groups(col_info, kind='DGNS', aux='DGNS_IND')
-        px_g = self.vrsn_cd_groups(col_info, kind='PRCDR', aux='PRCDR_DT')
-        simple_cols = cols[(~col_info.Status.isnull()) &
-                           ~cols.column_name.isin(self.i2b2_map.values()) &
-                           col_info.dxpx.isnull()]
-
-        with lc.log.step('%(event)s from %(records)d %(source_table)s records',
-                         dict(event='stack dx, px', records=len(data),
-                              source_table=self.qualified_name())) as stack_step:
+    @classmethod
+    def column_groups(cls, cols: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+        '''Get diagnosis groups, procedure groups, and simple columns of (db) cols.
+
+        These depend only on the (curated and db) columns, so we
+        compute them once per process.
+        '''
+        def compute() -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+            # curated column info
+            col_info = cls.active_col_data()
+            # order col_info like db cols
+            col_info = col_info.set_index('column_name').loc[cols.column_name].reset_index()
+            dx_g = cls.vrsn_cd_groups(col_info, kind='DGNS', aux='DGNS_IND')
+            px_g = cls.vrsn_cd_groups(col_info, kind='PRCDR', aux='PRCDR_DT')
+            simple_cols = cols[(~col_info.Status.isnull()) &
+                               ~cols.column_name.isin(cls.i2b2_map.values()) &
+                               col_info.dxpx.isnull()]
+            return dx_g, px_g, simple_cols
+
+        return cls.registry().derived(('column_groups', cls, _column_key(cols)), compute)
+
+    def custom_obs(self, log: EventLogger,
+                   data: pd.DataFrame, cols: pd.DataFrame,
+                   codes: ConceptCodeCache) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        dx_g, px_g, simple_cols = self.column_groups(cols)
+
+        with log.step('%(event)s from %(records)d %(source_table)s records',
+                      dict(event='stack dx, px', records=len(data),
+                           source_table=self.qualified_name())) as stack_step:
             obs = None
-            obs_dx = self.dx_data(data, self.table_name, dx_g)
+            hits, misses = codes.hits, codes.misses
+            obs_dx = self.dx_data(data, self.table_name, dx_g, codes=codes)
             if obs_dx is not None:
                 stack_step.msg_parts.append(' %(dx_len)d diagnoses')
                 stack_step.argobj.update(dict(dx_len=len(obs_dx)))
                 obs = obs_dx
-            obs_px = self.px_data(data, self.table_name, px_g)
+            obs_px = self.px_data(data, self.table_name, px_g, codes=codes)
             if obs_px is not None:
                 stack_step.msg_parts.append(' %(px_len)d procedures')
                 stack_step.argobj.update(dict(px_len=len(obs_px)))
                 if obs is None:
                     obs = obs_px
                 else:
-                    obs = obs.append(obs_px)
+                    obs = _append_facts(obs, obs_px)
+            stack_step.msg_parts.append(' (codes: %(code_hits)d hits, %(code_misses)d misses)')
+            stack_step.argobj.update(dict(code_hits=codes.hits - hits,
+                                          code_misses=codes.misses - misses))
         return obs, simple_cols
 
     @classmethod
     def dx_data(cls, rif_data: pd.DataFrame,
                 table_name: str, dx_cols: pd.DataFrame,
                 log: logging.Logger=log,
-                vrsn_default: str='9') -> pd.DataFrame:
+                vrsn_default: str='9',
+                codes: Opt[ConceptCodeCache]=None) -> pd.DataFrame:
         """Combine diagnosis columns i2b2 style
 
         :param vrsn_default: for MAXDATA_IP, default to IDC9
+        :param codes: formatted codes from earlier chunks, if any
         """
         if len(dx_cols) < 1:
             return None
@@ -1251,18 +2342,19 @@ class _DxPxCombine(CMSRIFUpload):
         obs = obs_stack(rif_data, table_name, dx_cols,
                         id_vars=id_vars,
                         value_vars=value_vars).reset_index()
-        obs['valtype_cd'] = Valtype.coded.value
+        obs['valtype_cd'] = _constant(Valtype.coded.value, len(obs))
 
         if 'dgns_vrsn' not in obs.columns:
             obs['dgns_vrsn'] = vrsn_default
 
-        obs['concept_cd'] = fmt_dx_codes(obs.dgns_vrsn, obs.dgns_cd)
+        codes = ConceptCodeCache() if codes is None else codes
+        obs['concept_cd'] = codes.dx_codes(obs.dgns_vrsn, obs.dgns_cd)
 
         # We don't need this after all, do we?
         # poa_suffix = np.where(obs.dgns_poa_ind.isnull() | (obs.dgns_poa_ind == ' '),
         #                       '', '+POA:' + obs.dgns_poa_ind)
         pdx_suffix = np.where(obs.x == 1, '+PDX', '')
-        obs['modifier_cd'] = 'DX:' + obs.mod_grp + pdx_suffix
+        obs['modifier_cd'] = ('DX:' + obs.mod_grp + pdx_suffix).astype('category')
 
         obs = cls._map_cols(obs, cls.obs_value_cols, required=True)
         obs = cls._map_cols(obs, ['provider_id'])
@@ -1274,13 +2366,15 @@ class _DxPxCombine(CMSRIFUpload):
                 log: logging.Logger=log,
                 default_vrsn: str='HCPCS', exclude_vrsn: List[str]=['88', '99'],
                 px_source_mod: str='PX_SOURCE:CL',
-                obs_value_cols: List[str]=['provider_id', 'update_date']) -> pd.DataFrame:
+                obs_value_cols: List[str]=['provider_id', 'update_date'],
+                codes: Opt[ConceptCodeCache]=None) -> pd.DataFrame:
         """Combine procedure columns i2b2 style
 
         Forward-fill `start_date` because MAXDATA_IP has may procedure
         code columns but only one procedure date column.
 
         :param exclude_vrsn: indication that there was no procedure observed
+        :param codes: formatted codes from earlier chunks, if any
         """
         if len(px_cols) < 1:
             return None
@@ -1295,12 +2389,13 @@ class _DxPxCombine(CMSRIFUpload):
                         id_vars=_no_dups([cls.i2b2_map[v]
                                           for v in cls.obs_id_vars if v in cls.i2b2_map]),
                         value_vars=value_vars).reset_index()
-        obs['valtype_cd'] = Valtype.coded.value
-        obs['modifier_cd'] = px_source_mod
+        obs['valtype_cd'] = _constant(Valtype.coded.value, len(obs))
+        obs['modifier_cd'] = _constant(px_source_mod, len(obs))
         if 'prcdr_vrsn' not in obs.columns:
             obs['prcdr_vrsn'] = default_vrsn
         obs = obs[~obs.prcdr_vrsn.isin(exclude_vrsn)]
-        obs['concept_cd'] = fmt_px_codes(obs.prcdr_cd, obs.prcdr_vrsn)
+        codes = ConceptCodeCache() if codes is None else codes
+        obs['concept_cd'] = codes.px_codes(obs.prcdr_cd, obs.prcdr_vrsn)
 
         if 'prcdr_dt' in obs.columns:
             obs = obs.rename(columns=dict(prcdr_dt='start_date')).sort_values('instance_num')
@@ -1546,27 +2641,117 @@ class MAXRxUpload(CMSRIFUpload):
     ]
 
 
+BeneRange = NamedTuple('BeneRange', [
+    ('group_num', int),
+    ('bene_id_qty', int),
+    ('bene_id_first', Any),
+    ('bene_id_last', Any),
+    ('est_facts', float)])
+
+
+def chunk_costs(chunks: List[Any], rows: Dict[int, int], per_row: float) -> List[float]:
+    '''Estimate facts in each survey chunk from its rows of a table.
+
+    The survey records no rows for a chunk with none of the table,
+    so such a chunk costs nothing::
+
+    >>> from collections import namedtuple
+    >>> Chunk = namedtuple('Chunk', 'chunk_num bene_id_qty')
+    >>> chunks = [Chunk(1, 10), Chunk(2, 10), Chunk(3, 10)]
+    >>> chunk_costs(chunks, {1: 25, 3: 35}, per_row=2)
+    [50.0, 0.0, 70.0]
+
+    Where the table wasn't surveyed at all, we go by bene_id_qty::
+
+    >>> chunk_costs(chunks, {}, per_row=2)
+    [20.0, 20.0, 20.0]
+    '''
+    if not rows:
+        return [float(ntile.bene_id_qty * per_row) for ntile in chunks]
+    return [float(rows.get(ntile.chunk_num, 0) * per_row) for ntile in chunks]
+
+
+def balance_chunks(chunks: List[Any], costs: List[float], group_qty: int) -> List[BeneRange]:
+    '''Merge consecutive survey chunks into about `group_qty` groups of about equal cost.
+
+    >>> from collections import namedtuple
+    >>> Chunk = namedtuple('Chunk', 'chunk_num bene_id_qty bene_id_first bene_id_last')
+    >>> chunks = [Chunk(n, 10, n * 10, n * 10 + 9) for n in range(1, 9)]
+    >>> for g in balance_chunks(chunks, [1, 1, 1, 1, 1, 1, 10, 1], 3):
+    ...     print(g)
+    BeneRange(group_num=1, bene_id_qty=60, bene_id_first=10, bene_id_last=69, est_facts=6.0)
+    BeneRange(group_num=2, bene_id_qty=10, bene_id_first=70, bene_id_last=79, est_facts=10.0)
+    BeneRange(group_num=3, bene_id_qty=10, bene_id_first=80, bene_id_last=89, est_facts=1.0)
+
+    A chunk is never split, so a group can't cost less than its
+    costliest chunk, and we may get fewer groups than we asked for::
+
+    >>> [g.est_facts for g in balance_chunks(chunks, [1, 1, 1, 1, 1, 1, 100, 1], 4)]
+    [6.0, 100.0, 1.0]
+
+    With as many groups as chunks, chunks are left as they are::
+
+    >>> len(balance_chunks(chunks, [1, 1, 1, 1, 1, 1, 100, 1], 8))
+    8
+    '''
+    if group_qty >= len(chunks):
+        bounds = list(range(len(chunks) + 1))
+    else:
+        cum = np.cumsum(np.asarray(costs, dtype=float))
+        targets = cum[-1] * np.arange(1, group_qty) / group_qty
+        # Cut before or after the chunk that reaches each target, whichever is closer.
+        hi = np.searchsorted(cum, targets)
+        lo = hi - 1
+        lo_cum = np.where(lo >= 0, cum[np.maximum(lo, 0)], 0)
+        cuts = np.unique(np.where(targets - lo_cum < cum[hi] - targets, lo, hi) + 1)
+        bounds = [0] + [int(cut) for cut in cuts if 0 < cut < len(chunks)] + [len(chunks)]
+    return [BeneRange(group_num=ix + 1,
+                      bene_id_qty=sum(c.bene_id_qty for c in chunks[lo:hi]),
+                      bene_id_first=chunks[lo].bene_id_first,
+                      bene_id_last=chunks[hi - 1].bene_id_last,
+                      est_facts=float(sum(costs[lo:hi])))
+            for ix, (lo, hi) in enumerate(zip(bounds[:-1], bounds[1:]))]
+
+
 class _BeneIdGrouped(luigi.WrapperTask):
     group_tasks = cast(List[Type[CMSRIFUpload]], [])  # abstract
+    bene_groups = IntParam(default=0, significant=False,
+                           description='tasks per table, balanced by estimated facts; 0 for one per survey chunk')
+    fact_units = IntParam(default=0, significant=False,
+                          description='see CMSRIFUpload.fact_units')
 
     def requires(self) -> List[luigi.Task]:
-        deps = []  # type: List[luigi.Task]
+        survey = BeneIdSurvey()
+        results = survey.results()
+        deps = [survey]  # type: List[luigi.Task]
         for group_task in self.group_tasks:
-            survey = BeneIdSurvey()
-            deps += [survey]
-            results = survey.results()
             if results:
+                groups = self.bene_ranges(group_task, survey, results)
                 deps += [
                     group_task(
-                        group_num=ntile.chunk_num,
-                        group_qty=len(results),
-                        bene_id_qty=ntile.bene_id_qty,
-                        bene_id_first=ntile.bene_id_first,
-                        bene_id_last=ntile.bene_id_last)
-                    for ntile in results
+                        group_num=g.group_num,
+                        group_qty=len(groups),
+                        bene_id_qty=g.bene_id_qty,
+                        bene_id_first=g.bene_id_first,
+                        bene_id_last=g.bene_id_last,
+                        est_facts=int(g.est_facts),
+                        fact_units=self.fact_units)
+                    for g in groups
                 ]
         return deps
 
+    def uploads(self) -> List[CMSRIFUpload]:
+        return [task for task in self.requires() if isinstance(task, CMSRIFUpload)]
+
+    def bene_ranges(self, group_task: Type[CMSRIFUpload], survey: BeneIdSurvey,
+                    results: List[BeneChunk]) -> List[BeneRange]:
+        '''Estimate facts in each survey chunk; merge chunks into `bene_groups` of about equal work.
+
+        '''
+        costs = chunk_costs(results, survey.table_rows(group_task.table_name),
+                            group_task.facts_per_row())
+        return balance_chunks(results, costs, self.bene_groups or len(results))
+
 
 class CarrierClaims(_BeneIdGrouped):
     group_tasks = [CarrierClaimUpload, CarrierLineUpload]
@@ -1592,6 +2777,55 @@ class InpatientStays(_BeneIdGrouped):
     group_tasks = [MEDPAR_Upload, MAXDATA_IP_Upload]
 
 
+def makespan_report(workers: int) -> pd.DataFrame:
+    '''Dry run: predict how long CMSRIFLoad takes with `workers`,
+    starting chunks in survey order vs. biggest first.
+
+    Times are in estimated facts; nothing is loaded.
+    Run `python cms_pd.py [workers]` to log the report.
+    '''
+    families = [family for family in CMSRIFLoad().requires()
+                if isinstance(family, _BeneIdGrouped)]
+    work = [(family.task_family, [task.est_facts for task in family.uploads()])
+            for family in families]
+    work += [('(all)', [cost for _family, costs in work for cost in costs])]
+    return makespan_table(work, workers)
+
+
+def makespan_table(work: List[Tuple[str, List[float]]], workers: int) -> pd.DataFrame:
+    '''Summarize work as scheduled in the given order vs. longest first.
+
+    >>> makespan_table([('Claims', [1, 1, 1, 1, 4]), ('Stays', [3, 3])], workers=2)
+            tasks  total  biggest  lower_bound  in_order  biggest_first
+    Claims      5    8.0      4.0          4.0       6.0            4.0
+    Stays       2    6.0      3.0          3.0       3.0            3.0
+    '''
+    rows = []
+    for name, costs in work:
+        total = float(sum(costs))
+        biggest = float(max(costs)) if costs else 0.0
+        rows.append(dict(name=name, tasks=len(costs), total=total, biggest=biggest,
+                         lower_bound=max(total / workers, biggest),
+                         in_order=list_schedule(costs, workers),
+                         biggest_first=list_schedule(sorted(costs, reverse=True), workers)))
+    return pd.DataFrame(rows, columns=['name', 'tasks', 'total', 'biggest', 'lower_bound',
+                                       'in_order', 'biggest_first']).set_index('name').rename_axis(None)
+
+
+def list_schedule(costs: List[float], workers: int) -> float:
+    '''Makespan of handing out tasks, in order, to whichever worker is free first.
+
+    >>> list_schedule([1, 1, 1, 1, 4], workers=2)
+    6.0
+    >>> list_schedule([4, 1, 1, 1, 1], workers=2)
+    4.0
+    '''
+    free = [0.0] * max(workers, 1)
+    for cost in costs:
+        heapq.heappush(free, heapq.heappop(free) + cost)
+    return max(free)
+
+
 def obj_string(df: pd.DataFrame,
                clobs: List[str]=[],
                pad: int=4) -> Dict[str, sqla.types.String]:
@@ -1692,14 +2926,14 @@ class VisitDimForPatGroup(_LoadTask):
             parallel_degree=self.parallel_degree, view=self.view)
         pat_range = dict(lo=self.patient_num_lo, hi=self.patient_num_hi)  # type: Params
         log_plan(lc, event=self.view, sql=q,
-                 params=pat_range)
+                 params=pat_range, schema_digest=str(self.prep_script.digest()))
 
         # clean up from any earlier failed attempts
         lc.execute("delete from {i2b2_star}.{dim_table} where patient_num between :lo and :hi".format(
             i2b2_star=vdim.schema, dim_table=vdim.name), params=pat_range)
         lc.execute('commit')
 
-        chunks = pd.read_sql(q, lc._conn, params=pat_range, chunksize=self.chunk_size)
+        chunks = RowStream(lc._conn, sqla.text(q), pat_range, size=lambda: self.chunk_size)
         subtot = 0
         while 1:
             with lc.log.step('UP#%(upload_id)d: %(event)s x%(chunk_size)d into %(i2b2_star)s.%(dim_table)s',
@@ -1709,6 +2943,7 @@ class VisitDimForPatGroup(_LoadTask):
                     visit_chunk = next(chunks)
                 except StopIteration:
                     break
+                _fetch_progress(chunks, step)
                 visit_chunk = self.with_admin(visit_chunk, upload_id, lc, vdim)
                 with self.connection('insert visits') as writing:
                     visit_chunk.to_sql(schema=vdim.schema, name=vdim.name,
@@ -1754,7 +2989,8 @@ class VisitCodesCache(_LoadTask):
     ]
 
     def load(self, work: LoggedConnection, upload: 'UploadTarget', upload_id: int, result: Params) -> None:
-        log_plan(work, event=self.view, sql='select * from ' + self.view, params={})
+        log_plan(work, event=self.view, sql='select * from ' + self.view, params={},
+                 schema_digest=str(self.prep_script.digest()))
         for step in self.steps:
             work.execute(step.format(view=self.view, table=self.table,
                                      parallel_degree=self.parallel_degree))
@@ -1816,3 +3052,15 @@ class _RIFTestData(object):
             'N': lambda: randint(100, 10000)
         }[valtype_cd]
         return f()  # type: ignore
+
+
+if __name__ == '__main__':
+    def _script() -> None:
+        from sys import argv
+
+        logging.basicConfig(level=logging.INFO)
+        workers = int(argv[1]) if len(argv) > 1 else 8
+        log.info('%(event)s with %(workers)d workers:\n%(report)s',
+                 dict(event='makespan', workers=workers,
+                      report=makespan_report(workers).to_string()))
+    _script()
@@ -5,11 +5,12 @@ Note: This is source-agnostic but not target-agnositc; it has i2b2
 
 '''
 
-from typing import Any, Callable, Dict, Iterator, List, Optional as Opt, Tuple, cast
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional as Opt, Set, Tuple, cast
 from contextlib import contextmanager
-from datetime import datetime
+from datetime import datetime, timedelta
 import csv
 import logging
+import re
 
 from luigi.contrib.sqla import SQLAlchemyTarget
 from sqlalchemy import text as sql_text, func, Table  # type: ignore
@@ -24,9 +25,13 @@ from cx_Oracle import Error as OraError, _Error as Ora_Error
 
 from eventlog import EventLogger, LogState, JSONObject
 from param_val import StrParam, IntParam, BoolParam
+import plan_cache
+import schema_cache
+import session_pool
+import ttl_store
 from script_lib import Script
 from sql_syntax import Environment, Params, SQL
-from sql_syntax import params_used, first_cursor
+from sql_syntax import params_used, first_cursor, ddl_tables
 
 log = logging.getLogger(__name__)
 
@@ -35,26 +40,11 @@ class _MaxIdleTarget(SQLAlchemyTarget):
     @property
     def engine(self) -> Engine:
         """
-        Override SQLAlchemyTarget.engine to address Oracle timeouts.
+        Override SQLAlchemyTarget.engine to share pooled sessions
+        (see `session_pool`), recycled to address Oracle timeouts.
         """
-        sqlalchemy = sqla
-        import os  # KLUDGE!
-        pid = os.getpid()
-        engine_dict = SQLAlchemyTarget._engine_dict  # type: ignore
-        conn = engine_dict.get(self.connection_string)
-        if not conn or conn.pid != pid:
-            # create and reset connection
-            pool_recycle = -1
-            if 'oracle' in self.connection_string:
-                pool_recycle = DBAccessTask().max_idle  # a bit of a KLUDGE
-            engine = sqlalchemy.create_engine(  # type: ignore
-                self.connection_string,
-                connect_args=self.connect_args,
-                echo=self.echo,
-                pool_recycle=pool_recycle
-            )
-            engine_dict[self.connection_string] = self.Connection(engine, pid)
-        return engine_dict[self.connection_string].engine  # type: ignore
+        return session_pool.registry.pool(
+            self.connection_string, echo=self.echo, connect_args=self.connect_args).engine
 
 
 class DBTarget(_MaxIdleTarget):
@@ -112,12 +102,17 @@ class LoggedConnection(object):
     .. note:: A LoggedConnection wraps only the `execute` and `scalar`
               methods from the sqlalchemy API.
 
+    :param explain_plans: always, cache, or skip; see `log_plan`
     '''
     def __init__(self, conn: Connection, log: EventLogger,
-                 step: LogState) -> None:
+                 step: LogState, explain_plans: str='always',
+                 plans: Opt[plan_cache.PlanCache]=None, plan_ttl: timedelta=timedelta(0)) -> None:
         self._conn = conn
         self.log = log
         self.step = step
+        self.explain_plans = explain_plans
+        self.plans = plans
+        self.plan_ttl = plan_ttl
 
     def __repr__(self) -> str:
         return '%s(%s, %s)' % (self.__class__.__name__, self._conn, self.log)
@@ -167,6 +162,39 @@ class DBAccessTask(luigi.Task):
     max_idle = IntParam(description='Set to less than Oracle profile max idle time.',
                         default=60 * 20,
                         significant=False)
+    schema_cache_ttl = IntParam(description='Seconds to trust reflected table details.',
+                                default=60 * 60,
+                                significant=False)
+    schema_cache_path = StrParam(description='File to share reflected table details in (optional).',
+                                 default='',
+                                 significant=False)
+    upload_status_ttl = IntParam(description='Seconds to trust the list of completed uploads; 0 to query each time.',
+                                 default=60,
+                                 significant=False)
+    complete_ttl = IntParam(description='Seconds to trust a script completion query; 0 to query each time.',
+                            default=60,
+                            significant=False)
+    pool_size = IntParam(description='Sessions to keep per account per process.',
+                         default=5,
+                         significant=False)
+    pool_overflow = IntParam(description='Sessions to allow beyond pool_size while busy.',
+                             default=10,
+                             significant=False)
+    pool_timeout = IntParam(description='Seconds to wait for a session from the pool.',
+                            default=30,
+                            significant=False)
+    pool_prewarm = IntParam(description='Sessions to log on when the luigi worker (not each task) first connects.',
+                            default=0,
+                            significant=False)
+    explain_plans = StrParam(description='always, cache (see plan_cache), or skip.',
+                             default='cache',
+                             significant=False)
+    plan_cache_ttl = IntParam(description='Seconds to trust a cached plan.',
+                              default=60 * 60 * 12,
+                              significant=False)
+    plan_cache_path = StrParam(description='File to share plans in, e.g. in the run directory (optional).',
+                               default='',
+                               significant=False)
     _log = logging.getLogger(__name__)  # ISSUE: ambient.
 
     def output(self) -> luigi.Target:
@@ -178,6 +206,9 @@ class DBAccessTask(luigi.Task):
                         echo=self.echo)
 
     def _make_url(self, account: str) -> str:
+        '''Make a connection URL for `account`,
+        configuring its session pool (see `session_pool.registry`).
+        '''
         url = make_url(account)
         if 'oracle' in account.lower():
             url.query['pool_recycle'] = self.max_idle
@@ -190,6 +221,9 @@ class DBAccessTask(luigi.Task):
             host, port = self.ssh_tunnel.split(':', 1)
             url.host = host
             url.port = port
+        session_pool.registry.configure(
+            str(url), max_idle=self.max_idle, size=self.pool_size, overflow=self.pool_overflow,
+            timeout=self.pool_timeout, prewarm=self.pool_prewarm, echo=self.echo)
         return str(url)
 
     def log_info(self) -> Dict[str, Any]:
@@ -199,13 +233,51 @@ class DBAccessTask(luigi.Task):
                     task_family=self.task_family,
                     task_hash=self.task_id[-luigi.task.TASK_ID_TRUNCATE_HASH:])
 
+    def reflect(self, schema: str, tables: List[str]) -> sqla.MetaData:
+        '''Get details of `tables` in `schema`, reflecting only those not cached.
+
+        See `schema_cache`.
+        '''
+        cache = schema_cache.shared(self.schema_cache_path or None)
+        return cache.reflect(self._dbtarget().engine, schema, tables,
+                             ttl=timedelta(seconds=self.schema_cache_ttl))
+
+    def forget_tables(self, tables: List[str]) -> int:
+        '''Forget cached details of `tables` (in any schema), e.g. after DDL.
+
+        :return: count of entries forgotten
+        '''
+        cache = schema_cache.shared(self.schema_cache_path or None)
+        return sum(cache.invalidate(table=name) for name in tables)
+
+    def _pool(self) -> session_pool.SessionPool:
+        '''Get this process's pool of sessions for our account.
+        '''
+        return session_pool.registry.pool(self._make_url(self.account))
+
     @contextmanager
     def connection(self, event: str='connect') -> Iterator[LoggedConnection]:
-        conn = ConnectionProblem.tryConnect(self._dbtarget().engine)
+        '''Check out a session from our pool for the duration of an event.
+        '''
+        pool = self._pool()
         log = EventLogger(self._log, self.log_info())
         with log.step('%(event)s: <%(account)s>',
                       dict(event=event, account=self.account)) as step:
-            yield LoggedConnection(conn, log, step)
+            try:
+                conn, checkout = pool.connect()
+            except DatabaseError as exc:
+                raise ConnectionProblem.refine(exc, str(pool.engine)) from None
+            step.msg_parts.append(' (%(pool_checkout)s session in %(pool_wait).3fs)')
+            step.argobj.update(dict(pool.stats(),
+                                    pool_checkout='pooled' if checkout.hit else 'new',
+                                    pool_wait=checkout.wait_sec))
+            try:
+                yield LoggedConnection(conn, log, step,
+                                       explain_plans=self.explain_plans,
+                                       plans=plan_cache.shared(self.plan_cache_path or None),
+                                       plan_ttl=timedelta(seconds=self.plan_cache_ttl))
+            finally:
+                conn.close()
 
     def _fix_password(self, environ: Dict[str, str], getpass: Callable[[str], str]) -> None:
         '''for interactive use; e.g. in notebooks
@@ -214,6 +286,44 @@ class DBAccessTask(luigi.Task):
             environ[self.passkey] = getpass(self.passkey)
 
 
+class CompletionCache(ttl_store.TTLStore[bool]):
+    '''Remember results of completion queries for a while.
+
+    The same dependency scripts (`cms_keys`, `i2b2_crc_design`, ...)
+    appear under many tasks, so luigi asks whether each is complete
+    many times per scheduling pass::
+
+        >>> from ttl_store import _TestClock
+        >>> clock = _TestClock()
+        >>> cache = CompletionCache(clock=clock)
+        >>> minute = timedelta(minutes=1)
+        >>> cache.get('cms_keys', ttl=minute) is None
+        True
+        >>> cache.put('cms_keys', True)
+        >>> cache.get('cms_keys', ttl=minute), cache.hits, cache.misses
+        (True, 1, 1)
+
+    Results expire after `ttl` or when forgotten, e.g. after a run::
+
+        >>> cache.put('cms_dem_txform', False)
+        >>> cache.forget('cms_dem_txform')
+        >>> cache.get('cms_dem_txform', ttl=minute) is None
+        True
+        >>> clock.advance(2 * minute)
+        >>> cache.get('cms_keys', ttl=minute) is None
+        True
+
+    As with `CompletedUploads`, a new process starts over.
+
+    :param clock: for testing
+    '''
+    def __init__(self, clock: Callable[[], datetime]=datetime.now) -> None:
+        ttl_store.TTLStore.__init__(self, clock=clock, per_process=True)
+
+
+completion_cache = CompletionCache()
+
+
 class SqlScriptTask(DBAccessTask):
     '''Task to run a stylized SQL script.
 
@@ -276,17 +386,37 @@ class SqlScriptTask(DBAccessTask):
 
         It should be a scalar query that returns non-zero for done
         and either zero or an error for not done.
+
+        Results are shared (see `CompletionCache`) for `complete_ttl` seconds;
+        errors are not, lest a transient one make a finished script look unfinished.
         '''
         last_query = self.last_query()
         params = params_used(self.complete_params(), last_query)
+        key = self._complete_key(last_query, params)
+        if self.complete_ttl > 0:
+            known = completion_cache.get(key, ttl=timedelta(seconds=self.complete_ttl))
+            if known is not None:
+                return known
         with self.connection(event=self.task_family + ' complete query: ' + self.script.name) as conn:
             try:
-                result = conn.scalar(sql_text(last_query), params)
-                return bool(result)
+                result = bool(conn.scalar(sql_text(last_query), params))
             except DatabaseError as exc:
                 conn.log.warning('%(event)s: %(exc)s',
                                  dict(event='complete query error', exc=exc))
                 return False
+        completion_cache.put(key, result)
+        return result
+
+    def forget_complete(self) -> None:
+        '''Forget any shared result of our completion query, e.g. since we just ran.
+        '''
+        last_query = self.last_query()
+        completion_cache.forget(self._complete_key(
+            last_query, params_used(self.complete_params(), last_query)))
+
+    def _complete_key(self, last_query: SQL, params: Params) -> Hashable:
+        return (self.account, self.script.digest(), last_query,
+                tuple(sorted(params.items())))
 
     def last_query(self) -> SQL:
         """
@@ -353,6 +483,7 @@ class SqlScriptTask(DBAccessTask):
                                      dict(event='ignore', error=err))
                 else:
                     raise err from None
+        self.forget_complete()
         if bulk_rows > 0:
             conn.step.msg_parts.append(' %(rowtotal)s total rows')
             conn.step.argobj.update(dict(rowtotal=bulk_rows))
@@ -371,6 +502,8 @@ class SqlScriptTask(DBAccessTask):
         self.set_status_message(
             '%s:%s:\n%s\n%s' % (fname, line, statement, params))
         conn.execute(statement, params)
+        # e.g. pdim_add_cols.sql: don't let reflect() serve the old columns.
+        self.forget_tables(ddl_tables(statement))
         return ignore_error
 
     def is_bulk(self, statement: SQL) -> bool:
@@ -386,18 +519,38 @@ class SqlScriptTask(DBAccessTask):
 
 
 def log_plan(lc: LoggedConnection, event: str, params: Dict[str, Any],
-             query: Opt[Select]=None, sql: Opt[str]=None) -> None:
+             query: Opt[Select]=None, sql: Opt[str]=None,
+             schema_digest: str='') -> List[str]:
+    '''Log the plan for `query` or `sql`.
+
+    Per `lc.explain_plans`, we explain each time, once per `plan_cache`
+    entry (logging just the plan hash when cached), or not at all.
+
+    :param schema_digest: see `plan_cache.PlanCache.plan`
+    :return: lines of the plan, e.g. for `plan_rows`
+    '''
     if query is not None:
         sql = str(query.compile(bind=lc._conn))
-    if sql is None:
-        return
-    plan = explain_plan(lc, sql)
+    if sql is None or lc.explain_plans == 'skip':
+        return []
+    if lc.explain_plans == 'cache' and lc.plans is not None:
+        plan, cached = lc.plans.plan(schema_cache.url_key(lc._conn.engine.url), sql, schema_digest,
+                                     lc.plan_ttl, lambda text: explain_plan(lc, text))
+    else:
+        plan, cached = explain_plan(lc, sql), False
     param_msg = ', '.join('%%(%s)s' % k for k in params.keys())
-    lc.log.info('%(event)s [' + param_msg + ']\n'
-                'query: %(query_peek)s plan:\n'
-                '%(plan)s',
-                dict(params, event=event, query_peek=_peek(sql),
-                     plan='\n'.join(plan)))
+    if cached:
+        lc.log.info('%(event)s [' + param_msg + ']\n'
+                    'query: %(query_peek)s plan hash: %(plan_hash)s (cached)',
+                    dict(params, event=event, query_peek=_peek(sql),
+                         plan_hash=plan_cache.plan_hash(plan)))
+    else:
+        lc.log.info('%(event)s [' + param_msg + ']\n'
+                    'query: %(query_peek)s plan:\n'
+                    '%(plan)s',
+                    dict(params, event=event, query_peek=_peek(sql),
+                         plan='\n'.join(plan)))
+    return plan
 
 
 def explain_plan(work: LoggedConnection, statement: SQL) -> List[str]:
@@ -410,6 +563,35 @@ def explain_plan(work: LoggedConnection, statement: SQL) -> List[str]:
     return [row.line for row in plan]  # type: ignore  # sqla
 
 
+def plan_rows(plan: List[str]) -> Opt[int]:
+    '''Get the optimizer's row estimate for a whole statement from its plan.
+
+    >>> plan_rows("""Plan hash value: 2137789089
+    ... -----------------------------------------------------------------------------
+    ... | Id  | Operation         | Name         | Rows  | Bytes | Cost (%CPU)| Time |
+    ... -----------------------------------------------------------------------------
+    ... |   0 | SELECT STATEMENT  |              |  1234K|   16M |  2048   (1)| 00:01|
+    ... |*  1 |  TABLE ACCESS FULL| BCARRIER_CLA |  1234K|   16M |  2048   (1)| 00:01|
+    ... """.splitlines())
+    1234000
+
+    >>> plan_rows(['no plan here']) is None
+    True
+    '''
+    rows_ix = None
+    for line in plan:
+        cells = [cell.strip() for cell in line.split('|')]
+        if rows_ix is None:
+            if 'Id' in cells and 'Rows' in cells:
+                rows_ix = cells.index('Rows')
+        elif len(cells) > rows_ix and cells[1].lstrip('*') == '0':
+            m = re.match(r'^(\d+)([KMGT]?)$', cells[rows_ix])
+            if not m:
+                return None
+            return int(m.group(1)) * 1000 ** ' KMGT'.index(m.group(2) or ' ')
+    return None
+
+
 def maybe_ora_err(exc: Exception) -> Opt[Ora_Error]:
     if isinstance(exc, DatabaseError):
         if isinstance(exc.orig, OraError):
@@ -499,7 +681,8 @@ class UploadTask(I2B2Task, SqlScriptTask):
         return UploadTarget(self._make_url(self.account),
                             self.project.upload_table,
                             self.transform_name, self.source,
-                            echo=self.echo)
+                            echo=self.echo,
+                            status_ttl=self.upload_status_ttl)
 
     def requires(self) -> List[luigi.Task]:
         return [self.project, self.source] + SqlScriptTask.requires(self)
@@ -539,10 +722,9 @@ class UploadTask(I2B2Task, SqlScriptTask):
                 '%(filename)s:%(lineno)s: %(event)s',
                 dict(event='bulk_insert',
                      filename=fname, lineno=line)):
-            plan = '\n'.join(explain_plan(conn, first_cursor(statement)))
-            conn.log.info('%(filename)s:%(lineno)s: %(event)s:\n%(plan)s',
-                          dict(filename=fname, lineno=line, event='plan',
-                               plan=plan))
+            plan = '\n'.join(log_plan(conn, event='plan', params=dict(filename=fname, lineno=line),
+                                      sql=first_cursor(statement),
+                                      schema_digest=str(self.script.digest())))
 
             params = params_used(run_params, statement)
             chunk_ix = 0
@@ -575,12 +757,16 @@ class UploadTask(I2B2Task, SqlScriptTask):
 
 
 class UploadTarget(DBTarget):
+    '''
+    :param status_ttl: seconds to trust `completed_uploads`; 0 to query each time
+    '''
     def __init__(self, connection_string: str,
                  table: sqla.Table, transform_name: str, source: SourceTask,
-                 echo: bool=False) -> None:
+                 echo: bool=False, status_ttl: int=0) -> None:
         DBTarget.__init__(self, connection_string,
                           echo=echo)
         self.table = table
+        self.status_ttl = status_ttl
         self.source = source
         self.transform_name = transform_name
         self.upload_id = None  # type: Opt[int]
@@ -590,15 +776,21 @@ class UploadTarget(DBTarget):
             self.__class__.__name__, self.transform_name)
 
     def exists(self) -> bool:
+        if self.status_ttl > 0:
+            return self.transform_name in completed_uploads.names(
+                self.engine, self.table, ttl=timedelta(seconds=self.status_ttl))
         conn = ConnectionProblem.tryConnect(self.engine)
-        with conn.begin():
-            up_t = self.table
-            upload_id = conn.scalar(
-                sqla.select([sqla.func.max(up_t.c.upload_id)])
-                .select_from(up_t)
-                .where(sqla.and_(up_t.c.transform_name == self.transform_name,
-                                 up_t.c.load_status == 'OK')))
-            return upload_id is not None
+        try:
+            with conn.begin():
+                up_t = self.table
+                upload_id = conn.scalar(
+                    sqla.select([sqla.func.max(up_t.c.upload_id)])
+                    .select_from(up_t)
+                    .where(sqla.and_(up_t.c.transform_name == self.transform_name,
+                                     up_t.c.load_status == 'OK')))
+                return upload_id is not None
+        finally:
+            conn.close()
 
     @contextmanager
     def job(self, task: DBAccessTask,
@@ -631,6 +823,7 @@ class UploadTarget(DBTarget):
                          .where(up_t.c.upload_id == upload_id)
                          .values(load_status='OK', end_date=func.now(),
                                  **result))
+            completed_uploads.done(self.engine, up_t, self.transform_name)
 
     def insert(self, conn: LoggedConnection, label: str, user_id: str) -> int:
         '''
@@ -654,6 +847,84 @@ class UploadTarget(DBTarget):
         return upload_id
 
 
+class CompletedUploads(ttl_store.TTLStore[Set[str]]):
+    '''Remember which transforms have an upload with load_status OK.
+
+    Building the dependency graph for thousands of upload tasks would
+    take thousands of `max(upload_id)` queries; instead, we get all the
+    completed transform_names in one query and trust them for `ttl`::
+
+        >>> from ttl_store import _TestClock
+        >>> db = sqla.create_engine('sqlite://')
+        >>> up_t = sqla.Table('upload_status', sqla.MetaData(),
+        ...                   *[sqla.Column(c.name, c.type)
+        ...                     for c in I2B2ProjectCreate.upload_status_columns])
+        >>> up_t.create(db)
+        >>> _ = db.execute(up_t.insert(), [
+        ...     dict(upload_id=1, transform_name='T1', load_status='OK'),
+        ...     dict(upload_id=2, transform_name='T2', load_status=None)])
+        >>> clock = _TestClock()
+        >>> uploads = CompletedUploads(clock=clock)
+        >>> minute = timedelta(minutes=1)
+
+        >>> sorted(uploads.names(db, up_t, ttl=minute))
+        ['T1']
+        >>> 'T2' in uploads.names(db, up_t, ttl=minute), uploads.queries
+        (False, 1)
+
+    Uploads completed by this process count right away; others, once
+    the list expires::
+
+        >>> uploads.done(db, up_t, 'T3')
+        >>> _ = db.execute(up_t.update().where(up_t.c.upload_id == 2).values(load_status='OK'))
+        >>> sorted(uploads.names(db, up_t, ttl=minute)), uploads.queries
+        (['T1', 'T3'], 1)
+        >>> clock.advance(2 * minute)
+        >>> sorted(uploads.names(db, up_t, ttl=minute)), uploads.queries
+        (['T1', 'T2'], 2)
+
+    A new process (e.g. a forked worker) starts over, since other
+    workers may have finished uploads in the mean time.
+
+    :param clock: for testing
+    '''
+    def __init__(self, clock: Callable[[], datetime]=datetime.now) -> None:
+        ttl_store.TTLStore.__init__(self, clock=clock, per_process=True)
+
+    @property
+    def queries(self) -> int:
+        return self.misses
+
+    def names(self, engine: Engine, table: sqla.Table, ttl: timedelta) -> Set[str]:
+        '''Get transform_names of uploads with load_status OK in `table`.
+        '''
+        key = (schema_cache.url_key(engine.url), table.fullname)
+        known = self.get(key, ttl)
+        if known is not None:
+            return known
+        conn = ConnectionProblem.tryConnect(engine)
+        try:
+            names = set(name for (name,) in conn.execute(
+                sqla.select([table.c.transform_name]).distinct()
+                .where(table.c.load_status == 'OK')))
+        finally:
+            conn.close()
+        log.info('%(event)s: %(qty)d in %(table)s',
+                 dict(event='completed uploads', qty=len(names), table=table.fullname))
+        self.put(key, names)
+        return names
+
+    def done(self, engine: Engine, table: sqla.Table, transform_name: str) -> None:
+        '''Note an upload completed by this process.
+        '''
+        names = self.peek((schema_cache.url_key(engine.url), table.fullname))
+        if names is not None:
+            names.add(transform_name)
+
+
+completed_uploads = CompletedUploads()
+
+
 class I2B2ProjectCreate(DBAccessTask):
     star_schema = StrParam(description='see client.cfg')
     project_id = StrParam(description='see client.cfg')
@@ -695,10 +966,7 @@ class I2B2ProjectCreate(DBAccessTask):
         return meta
 
     def table_details(self, lc: LoggedConnection, tables: List[str]) -> sqla.MetaData:
-        i2b2_meta = sqla.MetaData(schema=self.star_schema)
-        i2b2_meta.reflect(only=tables, schema=self.star_schema,
-                          bind=self._dbtarget().engine)
-        return i2b2_meta
+        return self.reflect(self.star_schema, tables)
 
     @property
     def upload_table(self) -> sqla.Table:
@@ -0,0 +1,85 @@
+'''keyset -- walk a range of keys in order, a bounded sub-range at a time
+
+With `rownum` as `src_ix` and no ORDER BY, which source row gets
+which `src_ix` (and hence `instance_num`) is up to the optimizer, so
+a rerun or a resumed upload can't count on it. Instead, given row
+counts by key (bene_id) in index order, we split the range into
+sub-ranges of about `max_rows` rows, never splitting a key, and note
+how many rows come before each; numbering rows within a sub-range
+(by key, then rowid) from that offset gives each row the same
+`src_ix` every time, whichever sub-range is fetched first::
+
+    >>> counts = [('b1', 3), ('b2', 1), ('b3', 4), ('b4', 2), ('b5', 5)]
+    >>> for r in key_ranges(counts, max_rows=4):
+    ...     print(r)
+    KeyRange(key_lo='b1', key_hi='b2', offset=0, rows=4)
+    KeyRange(key_lo='b3', key_hi='b3', offset=4, rows=4)
+    KeyRange(key_lo='b4', key_hi='b4', offset=8, rows=2)
+    KeyRange(key_lo='b5', key_hi='b5', offset=10, rows=5)
+
+A key with more than `max_rows` rows gets a sub-range to itself.
+
+Sub-ranges don't depend on each other, so we can fetch several at
+once, each on its own session, and still take them in order,
+with no more than `workers` in hand at a time::
+
+    >>> fetched = []
+    >>> def fetch(r):
+    ...     fetched.append(r.key_lo)
+    ...     return [r.key_lo] * r.rows
+    >>> [len(rows) for rows in fetch_in_order(key_ranges(counts, 4), fetch, workers=2)]
+    [4, 4, 2, 5]
+    >>> sorted(fetched)
+    ['b1', 'b3', 'b4', 'b5']
+
+'''
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, List, NamedTuple, Tuple, TypeVar
+
+T = TypeVar('T')
+
+KeyRange = NamedTuple('KeyRange', [
+    ('key_lo', Any),
+    ('key_hi', Any),
+    ('offset', int),  # rows before key_lo
+    ('rows', int)])
+
+
+def key_ranges(counts: Iterable[Tuple[Any, int]], max_rows: int) -> List[KeyRange]:
+    '''Split keys, with their row counts in key order, into sub-ranges of about `max_rows` rows.
+    '''
+    ranges = []  # type: List[KeyRange]
+    lo, hi, offset, rows = None, None, 0, 0
+    for key, qty in counts:
+        if lo is not None and rows + qty > max_rows:
+            ranges.append(KeyRange(lo, hi, offset, rows))
+            lo, offset, rows = None, offset + rows, 0
+        if lo is None:
+            lo = key
+        hi, rows = key, rows + qty
+    if lo is not None:
+        ranges.append(KeyRange(lo, hi, offset, rows))
+    return ranges
+
+
+def fetch_in_order(ranges: Iterable[KeyRange], fetch: Callable[[KeyRange], T],
+                   workers: int) -> Iterator[T]:
+    '''Fetch up to `workers` sub-ranges at once, in threads; yield results in order.
+
+    Errors in a thread are raised to the consumer.
+    '''
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        pending = deque()  # type: deque
+        Future  # let flake8 know we're using it
+        try:
+            for r in ranges:
+                pending.append(pool.submit(fetch, r))
+                if len(pending) >= workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for f in pending:  # type: Future
+                f.cancel()
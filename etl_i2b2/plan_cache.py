@@ -0,0 +1,110 @@
+'''plan_cache -- explain each statement once
+
+`log_plan` explains each chunked read, visit dimension group, and
+bulk insert, but thousands of tasks run the same handful of SQL
+statements with different bind values; each explanation costs two
+round trips. So we remember plans by (database, SQL with whitespace
+normalized, schema digest) for a while (`ttl`), in memory and,
+optionally, in a file in the run directory.
+
+Let's try it out with a stand-in for `explain_plan` and a clock we control::
+
+    >>> explained = []
+    >>> def explain(sql):
+    ...     explained.append(sql)
+    ...     return ['Plan hash value: 2137789089', '| 0 | SELECT STATEMENT |']
+    >>> from ttl_store import _TestClock
+    >>> clock = _TestClock()
+    >>> cache = PlanCache(clock=clock)
+    >>> hour = timedelta(hours=1)
+
+    >>> q = 'select * from bcarrier_claims where bene_id between :lo and :hi'
+    >>> plan, cached = cache.plan('oracle://me@db/sid', q, '', hour, explain)
+    >>> plan_hash(plan), cached
+    ('2137789089', False)
+
+The same SQL, even laid out differently, is explained only once::
+
+    >>> plan, cached = cache.plan('oracle://me@db/sid', q.replace(' where', '\\n  where'), '', hour, explain)
+    >>> cached, len(explained), cache.hits, cache.misses
+    (True, 1, 1, 1)
+
+... until the schema digest changes or the plan expires::
+
+    >>> plan, cached = cache.plan('oracle://me@db/sid', q, 'v2', hour, explain)
+    >>> cached, len(explained)
+    (False, 2)
+    >>> clock.advance(2 * hour)
+    >>> plan, cached = cache.plan('oracle://me@db/sid', q, 'v2', hour, explain)
+    >>> cached, len(explained)
+    (False, 3)
+
+With a `path`, a new cache (e.g. in another worker process) starts
+with what earlier ones explained::
+
+    >>> from pathlib import Path
+    >>> from tempfile import mkdtemp
+    >>> path = Path(mkdtemp()) / 'plan_cache.pkl'
+    >>> plan, cached = PlanCache(path, clock=clock).plan('oracle://me@db/sid', q, '', hour, explain)
+    >>> plan, cached = PlanCache(path, clock=clock).plan('oracle://me@db/sid', q, '', hour, explain)
+    >>> cached
+    True
+
+'''
+
+from datetime import timedelta
+from typing import Callable, List, Optional as Opt, Tuple
+import re
+
+import ttl_store
+
+
+class PlanCache(ttl_store.TTLStore[List[str]]):
+    '''Remember plans by (database, normalized SQL, schema digest).
+
+    :param path: file to persist plans in, if any
+    '''
+    def plan(self, db: str, sql: str, schema_digest: str, ttl: timedelta,
+             explain: Callable[[str], List[str]]) -> Tuple[List[str], bool]:
+        '''Get the plan for `sql`, explaining it only if not cached within `ttl`.
+
+        :param db: database, e.g. from `schema_cache.url_key`
+        :param schema_digest: changes when the objects `sql` refers to change
+        :return: plan lines, and whether they came from the cache
+        '''
+        key = (db, normalize(sql), schema_digest)
+        plan = self.get(key, ttl)
+        if plan is not None:
+            return plan, True
+        plan = explain(sql)
+        self.put(key, plan)
+        return plan, False
+
+
+def normalize(sql: str) -> str:
+    '''Normalize whitespace, so that layout doesn't matter.
+
+    >>> normalize("""select *
+    ...   from t  where x = :x""")
+    'select * from t where x = :x'
+    '''
+    return ' '.join(sql.split())
+
+
+def plan_hash(plan: List[str]) -> Opt[str]:
+    '''Find the plan hash value in DBMS_XPLAN output.
+
+    >>> plan_hash(['Plan hash value: 2137789089', '---']), plan_hash([])
+    ('2137789089', None)
+    '''
+    for line in plan:
+        m = re.match(r'\s*Plan hash value: (\d+)', line)
+        if m:
+            return m.group(1)
+    return None
+
+
+def shared(path: Opt[str]=None) -> PlanCache:
+    '''Get the process-wide cache for `path`.
+    '''
+    return ttl_store.shared(PlanCache, path)
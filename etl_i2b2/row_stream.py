@@ -0,0 +1,190 @@
+'''row_stream -- stream query results into DataFrames, a fetch at a time
+
+`pd.read_sql(..., chunksize=n)` leaves the DB-API cursor's
+`arraysize` at its default (100 rows for cx_Oracle), so a chunk of
+100000 rows costs 1000 network round trips. A `RowStream` sets
+`arraysize` (and cx_Oracle's `prefetchrows`) from the chunk size,
+builds each column as a numpy array straight from the fetched
+tuples, and keeps count of round trips and (estimated) bytes.
+
+Let's try it out with an in-memory SQLite database::
+
+    >>> import sqlalchemy as sqla
+    >>> db = sqla.create_engine('sqlite://')
+    >>> _ = db.execute('create table t (bene_id varchar(10), n integer, x float)')
+    >>> _ = db.execute("insert into t values ('b1', 1, 1.5), ('b2', 2, null), ('b3', 3, 3.5)")
+
+    >>> with db.connect() as conn:
+    ...     stream = RowStream(conn, sqla.text('select * from t where n >= :lo order by n'),
+    ...                        dict(lo=1), size=lambda: 2)
+    ...     chunks = list(stream)
+    >>> [len(chunk) for chunk in chunks]
+    [2, 1]
+    >>> chunks[0]
+      bene_id  n    x
+    0      b1  1  1.5
+    1      b2  2  NaN
+    >>> [str(dtype) for dtype in chunks[0].dtypes]
+    ['object', 'int64', 'float64']
+
+We count fetches, rows, and round trips (estimated from `arraysize`),
+in all and for the last fetch; the empty fetch at the end counts too::
+
+    >>> stream.fetches, stream.rows, stream.round_trips, stream.fetch_round_trips
+    (2, 3, 3, 1)
+    >>> stream.fetch_bytes > 0
+    True
+
+`arraysize` follows `size()`, up to `arraysize_max`, so each fetch
+takes as few round trips as we can afford::
+
+    >>> with db.connect() as conn:
+    ...     stream = RowStream(conn, sqla.text('select * from t'), {},
+    ...                        size=lambda: 3, arraysize_max=2)
+    ...     chunk = next(stream)
+    >>> stream.arraysize, stream.fetch_round_trips
+    (2, 2)
+
+'''
+
+from datetime import date
+from typing import Any, Callable, Dict, List, Optional as Opt, Sequence
+import math
+import numbers
+
+from sqlalchemy.engine import Connection
+from sqlalchemy.sql.expression import ClauseElement
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+
+from chunk_sizer import frame_bytes
+
+
+class RowStream(object):
+    '''Iterate over DataFrames of `size()` rows (as of each fetch) from a query.
+
+    :param conn: connection to run `statement` on, with a raw DB-API cursor
+    :param params: to bind to `statement`
+    :param arraysize_max: cap on rows per round trip, to bound fetch buffers
+    '''
+    def __init__(self, conn: Connection, statement: ClauseElement, params: Dict[str, Any],
+                 size: Callable[[], int], arraysize_max: int=10000) -> None:
+        self.size = size
+        self.arraysize_max = arraysize_max
+        self.arraysize = self._arraysize()
+        self.fetches = 0
+        self.rows = 0
+        self.round_trips = 0
+        self.bytes = 0
+        self.fetch_round_trips = 0
+        self.fetch_bytes = 0
+
+        dialect = conn.dialect
+        compiled = statement.compile(dialect=dialect)
+        bound = compiled.construct_params(params)
+        args = [bound[k] for k in compiled.positiontup] if compiled.positional else bound
+        self._cursor = cursor = conn.connection.cursor()
+        try:
+            cursor.arraysize = self.arraysize
+            if hasattr(cursor, 'prefetchrows'):
+                # One more than arraysize saves a round trip when all rows fit.
+                cursor.prefetchrows = self.arraysize + 1
+            cursor.execute(str(compiled), args)
+        except Exception:
+            cursor.close()
+            raise
+        names = [d[0] for d in cursor.description]
+        if getattr(dialect, 'requires_name_normalize', False):
+            names = [dialect.normalize_name(name) for name in names]
+        self.columns = names
+        self._kinds = column_kinds(cursor.description, dialect.dbapi)
+
+    def __repr__(self) -> str:
+        return '%s(arraysize=%d, fetches=%d, rows=%d)' % (
+            self.__class__.__name__, self.arraysize, self.fetches, self.rows)
+
+    def __iter__(self) -> 'RowStream':
+        return self
+
+    def __next__(self) -> pd.DataFrame:
+        if self._cursor is None:
+            raise StopIteration
+        qty = self.size()
+        self.arraysize = self._arraysize(qty)
+        self._cursor.arraysize = self.arraysize
+        rows = self._cursor.fetchmany(qty)
+        self.fetch_round_trips = max(1, int(math.ceil(len(rows) / self.arraysize)))
+        self.round_trips += self.fetch_round_trips
+        if not rows:
+            self.close()
+            raise StopIteration
+        columns = list(zip(*rows))
+        data = pd.DataFrame({name: column_array(values, kind)
+                             for name, values, kind in zip(self.columns, columns, self._kinds)},
+                            columns=self.columns)
+        self.fetches += 1
+        self.rows += len(data)
+        self.fetch_bytes = frame_bytes(data)
+        self.bytes += self.fetch_bytes
+        return data
+
+    def close(self) -> None:
+        if self._cursor is not None:
+            self._cursor.close()
+            self._cursor = None
+
+    def _arraysize(self, qty: Opt[int]=None) -> int:
+        return max(1, min(self.size() if qty is None else qty, self.arraysize_max))
+
+
+def column_kinds(description: Sequence[Sequence[Any]], dbapi: Any) -> List[Opt[str]]:
+    '''Classify columns as 'date', 'number', or 'text' by DB-API type, where known.
+    '''
+    def kind(type_code: Any) -> Opt[str]:
+        if type_code is None:
+            return None
+        for name, label in [('DATETIME', 'date'), ('NUMBER', 'number'), ('STRING', 'text')]:
+            if type_code == getattr(dbapi, name, None):
+                return label
+        return None
+    return [kind(d[1]) for d in description]
+
+
+def column_array(values: Sequence[Any], kind: Opt[str]) -> np.ndarray:
+    '''Build a column from fetched values, with NaN / NaT for nulls.
+
+    >>> column_array((1, 2), 'number')
+    array([1, 2])
+    >>> column_array((1, None, 2.5), 'number')
+    array([1. , nan, 2.5])
+    >>> from datetime import datetime
+    >>> when = column_array((datetime(2001, 2, 3), None), 'date')
+    >>> when.dtype, pd.isnull(when)
+    (dtype('<M8[ns]'), array([False,  True]))
+    >>> column_array(('a', None), 'text')
+    array(['a', None], dtype=object)
+
+    Where the DB-API doesn't tell us the type, we go by the first value::
+
+    >>> column_array((None, 3), None)
+    array([nan,  3.])
+    '''
+    if kind is None:
+        first = next((v for v in values if v is not None), None)
+        kind = ('number' if isinstance(first, numbers.Number) and not isinstance(first, bool) else
+                'date' if isinstance(first, date) else
+                'text')
+    arr = np.empty(len(values), dtype=object)
+    arr[:] = values
+    if kind == 'number':
+        nulls = pd.isnull(arr)
+        if not nulls.any():
+            return np.array(values)
+        arr[nulls] = np.nan
+        return arr.astype(float)
+    if kind == 'date':
+        try:
+            return pd.to_datetime(arr).values
+        except ValueError:  # e.g. out of bounds
+            return arr
+    return arr
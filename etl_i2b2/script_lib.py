@@ -58,7 +58,7 @@ as well as tables inserted into::
     ...            CMS_RIF: 'CMS_DEID', 'upload_id': '20', 'chunk_qty': 20,
     ...            'cms_source_cd': "'ccwdata.org'", 'source_table': 'T'}
     >>> Script.bene_chunks_survey.inserted_tables(variables)
-    ['bene_chunks']
+    ['bene_chunks', 'bene_chunk_rows']
 
 The last statement should be a scalar query that returns non-zero to
 signal that the script is complete:
@@ -80,7 +80,7 @@ The completion test may depend on a digest of the script and its dependencies:
     >>> last = Script.cms_dem_txform.statements(variables)[-1].strip()
     >>> print(last)
     select 1 up_to_date
-    from cms_dem_txform where design_digest = 880791033
+    from cms_dem_txform where design_digest = 3438174376
 
 Some scripts use variables that are not known until a task is run; for
 example, `&&upload_id` is used in names of objects such as tables and
@@ -0,0 +1,257 @@
+'''session_pool -- share database sessions within a process
+
+Logging on to Oracle over an ssh tunnel costs hundreds of
+milliseconds, so rather than a session per `DBAccessTask.connection`
+event, we keep a bounded pool of sessions per account (connection
+URL) per process, recycling any that sit idle longer than the
+database allows (`max_idle`), and count how often we find one ready.
+
+Let's try it out with an in-memory SQLite database::
+
+    >>> url = 'sqlite://'
+    >>> pool = SessionPool(url, max_idle=60 * 20)
+    >>> conn, checkout = pool.connect()
+    >>> conn.scalar('select 1 + 1')
+    2
+    >>> checkout.hit
+    False
+    >>> conn.close()
+
+The second time, the session is ready and waiting::
+
+    >>> conn, checkout = pool.connect()
+    >>> checkout.hit, pool.checkouts, pool.hits, pool.logons
+    (True, 2, 1, 1)
+    >>> conn.close()
+
+Pools are kept in a `registry`, by URL, with settings from
+`configure`. In the luigi worker process (where the registry was
+made), a new pool logs on `prewarm` sessions right away, so they're
+ready for the many `complete()` checks of a scheduling pass; logon
+times go in a histogram. (In-memory SQLite has just one session per
+thread.)::
+
+    >>> registry = EngineRegistry()
+    >>> registry.configure(url, max_idle=60 * 20, prewarm=2)
+    >>> pool = registry.pool(url)
+    >>> pool.logons, pool.logon_latency.total
+    (1, 1)
+    >>> registry.pool(url) is pool
+    True
+
+Each process has its own pools; a task process forked from the
+worker sets aside the pools it inherits, without logging off the
+worker's sessions, and doesn't prewarm, so each task logs on only
+the sessions it uses::
+
+    >>> pool.pid = registry.pid = -1  # as if forked
+    >>> child = registry.pool(url)
+    >>> child is pool, registry.inherited, child.logons
+    (False, 1, 0)
+
+Pool sizing applies to Oracle; other dialects get their default pools::
+
+    >>> sorted(pool_args('oracle://me@dbhost/sid', max_idle=1200, size=4, overflow=2, timeout=30).items())
+    [('max_overflow', 2), ('pool_recycle', 1200), ('pool_size', 4), ('pool_timeout', 30)]
+    >>> pool_args(url, max_idle=1200)
+    {}
+
+'''
+
+from threading import Lock, local
+from typing import Any, Dict, List, NamedTuple, Optional as Opt, Tuple
+import logging
+import os
+import time
+
+from sqlalchemy.engine import Connection
+from sqlalchemy.engine.url import make_url
+import sqlalchemy as sqla
+
+log = logging.getLogger(__name__)
+Checkout = NamedTuple('Checkout', [('hit', bool), ('wait_sec', float)])
+
+
+class LatencyHistogram(object):
+    '''Count latencies in roughly logarithmic buckets.
+
+    >>> h = LatencyHistogram()
+    >>> for sec in [0.004, 0.2, 0.25, 1.5, 12]:
+    ...     h.add(sec)
+    >>> h
+    <10ms:1 <300ms:2 <3s:1 >=10s:1
+    >>> h.total
+    5
+    '''
+    bounds = [0.01, 0.03, 0.1, 0.3, 1.0, 3.0, 10.0]
+    labels = ['<10ms', '<30ms', '<100ms', '<300ms', '<1s', '<3s', '<10s', '>=10s']
+
+    def __init__(self) -> None:
+        self.counts = [0] * len(self.labels)
+
+    def __repr__(self) -> str:
+        return ' '.join('%s:%d' % (label, qty)
+                        for label, qty in zip(self.labels, self.counts) if qty)
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts)
+
+    def add(self, sec: float) -> None:
+        self.counts[next((ix for ix, bound in enumerate(self.bounds) if sec < bound),
+                         len(self.bounds))] += 1
+
+
+class SessionPool(object):
+    '''Bounded pool of sessions for one account in one process.
+
+    :param url: connection URL (with password, if any)
+    :param max_idle: seconds after which to recycle a session
+    :param size: sessions to keep
+    :param overflow: sessions to allow beyond `size` while busy
+    :param timeout: seconds to wait for a session before giving up
+    :param prewarm: sessions to log on right away
+    '''
+    def __init__(self, url: str, max_idle: int=60 * 20,
+                 size: int=5, overflow: int=10, timeout: int=30, prewarm: int=0,
+                 echo: bool=False, connect_args: Opt[Dict[str, Any]]=None) -> None:
+        self.pid = os.getpid()
+        self.prewarm = prewarm
+        self.engine = sqla.create_engine(
+            url, echo=echo, connect_args=connect_args or {},
+            **pool_args(url, max_idle, size, overflow, timeout))
+        sqla.event.listen(self.engine, 'connect', self._logged_on)
+        self._lock = Lock()
+        self._thread = local()
+        self.checkouts = 0
+        self.hits = 0
+        self.logons = 0
+        self.wait_sec = 0.0
+        self.wait_max = 0.0
+        self.logon_latency = LatencyHistogram()
+
+    def __repr__(self) -> str:
+        return '%s(%s, checkouts=%d, hits=%d)' % (
+            self.__class__.__name__, repr(self.engine.url), self.checkouts, self.hits)
+
+    def _logged_on(self, _dbapi_conn: object, _record: object) -> None:
+        # The connect event fires in the thread that asked for the session.
+        self._thread.logged_on = True
+        with self._lock:
+            self.logons += 1
+
+    def connect(self) -> Tuple[Connection, Checkout]:
+        '''Check out a session: a ready one (hit) or a new logon.
+
+        The caller should close the connection to return the session.
+        '''
+        self._thread.logged_on = False
+        t0 = time.time()
+        conn = self.engine.connect()
+        wait_sec = time.time() - t0
+        hit = not self._thread.logged_on
+        with self._lock:
+            self.checkouts += 1
+            self.hits += int(hit)
+            self.wait_sec += wait_sec
+            self.wait_max = max(self.wait_max, wait_sec)
+            if not hit:
+                self.logon_latency.add(wait_sec)
+        return conn, Checkout(hit, wait_sec)
+
+    def set_aside(self) -> int:
+        '''Stop using this pool, inherited from a parent process,
+        without logging off its sessions, which are the parent's:
+        like `engine.dispose(close=False)` in later SQLAlchemy.
+
+        The caller should hold on to this pool so that garbage
+        collection doesn't close the sessions either.
+
+        :return: count of idle sessions set aside
+        '''
+        inherited = self.engine.pool
+        self.engine.pool = inherited.recreate()
+        self._inherited_pool = inherited
+        return inherited.checkedin() if hasattr(inherited, 'checkedin') else 0
+
+    def warm_up(self) -> None:
+        '''Log on `prewarm` sessions and put them in the pool.
+        '''
+        if self.prewarm <= 0:
+            return
+        t0 = time.time()
+        conns = [self.connect()[0] for _ in range(self.prewarm)]
+        for conn in conns:
+            conn.close()
+        log.info('%(event)s: %(qty)d sessions for %(url)s in %(sec)0.3fs; logons: %(latency)s',
+                 dict(event='prewarm', qty=len(conns), url=repr(self.engine.url),
+                      sec=time.time() - t0, latency=self.logon_latency))
+
+    def stats(self) -> Dict[str, Any]:
+        '''Pool metrics, e.g. for the event log.
+        '''
+        return dict(pool_checkouts=self.checkouts, pool_hits=self.hits,
+                    pool_logons=self.logons,
+                    pool_wait_sec=round(self.wait_sec, 3), pool_wait_max=round(self.wait_max, 3),
+                    pool_logon_latency=repr(self.logon_latency))
+
+
+def pool_args(url: str, max_idle: int,
+              size: int=5, overflow: int=10, timeout: int=30) -> Dict[str, Any]:
+    '''Queue pool arguments for `create_engine`, for Oracle.
+    '''
+    if not make_url(url).drivername.startswith('oracle'):
+        return {}
+    return dict(pool_size=size, max_overflow=overflow, pool_timeout=timeout,
+                pool_recycle=max_idle)
+
+
+class EngineRegistry(object):
+    '''Session pools (and their engines) by URL, for this process.
+    '''
+    def __init__(self) -> None:
+        self.pid = os.getpid()
+        self._settings = {}  # type: Dict[str, Dict[str, Any]]
+        self._pools = {}  # type: Dict[str, SessionPool]
+        # Closing an inherited session would log off the parent's
+        # session on the same socket, so we just hold on to them
+        # (see `SessionPool.set_aside`).
+        self._inherited = []  # type: List[SessionPool]
+        List  # let flake8 know we're using it
+        self._lock = Lock()
+
+    def __repr__(self) -> str:
+        return '%s(%d pools)' % (self.__class__.__name__, len(self._pools))
+
+    @property
+    def inherited(self) -> int:
+        return len(self._inherited)
+
+    def configure(self, url: str, **settings: Any) -> None:
+        '''Set `SessionPool` arguments for `url`, for pools created from now on.
+        '''
+        self._settings[url] = settings
+
+    def pool(self, url: str, **defaults: Any) -> SessionPool:
+        '''Get this process's pool for `url`, creating it if need be.
+
+        A new pool is warmed only in the process that made the registry.
+
+        :param defaults: `SessionPool` arguments not set by `configure`
+        '''
+        with self._lock:
+            pool = self._pools.get(url)
+            if pool is not None and pool.pid != os.getpid():
+                self._inherited.append(pool)
+                log.info('%(event)s: %(url)s from pid %(pid)s; %(qty)d idle sessions held',
+                         dict(event='set aside inherited pool', url=repr(pool.engine.url), pid=pool.pid,
+                              qty=pool.set_aside()))
+                pool = None
+            if pool is None:
+                pool = self._pools[url] = SessionPool(url, **dict(defaults, **self._settings.get(url, {})))
+                if os.getpid() == self.pid:
+                    pool.warm_up()
+            return pool
+
+
+registry = EngineRegistry()
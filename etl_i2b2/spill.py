@@ -0,0 +1,133 @@
+'''spill -- keep chunks of facts in (parquet) files, for replay
+
+A `DataLoadTask` with a `spill_dir` writes each chunk of facts it
+gets, just before inserting it, and, once it has them all, a marker
+with the chunk count, so that if an insert fails, we can load the
+chunks again without re-selecting and re-pivoting::
+
+    >>> from tempfile import mkdtemp
+    >>> spill = ChunkSpill(Path(mkdtemp()))
+    >>> facts = pd.DataFrame(dict(
+    ...     concept_cd=['ICD9:250', 'ICD9:250', 'DRG:123'],
+    ...     instance_num=[1000, 1001, 2000],
+    ...     tval_char=[None, None, 'E'],
+    ...     start_date=pd.to_datetime(['2001-01-01', None, '2001-01-03'])),
+    ...     columns=['concept_cd', 'instance_num', 'tval_char', 'start_date'])
+    >>> spill.write(20, 0, facts).name
+    'chunk_00000.parquet'
+    >>> spill.write(20, 1, facts[:1]).name
+    'chunk_00001.parquet'
+
+Chunks are keyed by upload_id and chunk number and read back in order::
+
+    >>> [(num, len(chunk)) for num, chunk in spill.chunks(20)]
+    [(0, 3), (1, 1)]
+    >>> spill.chunk_nums(20), spill.chunk_nums(21)
+    ([0, 1], [])
+
+... with the same values, including nulls; codes come back as categoricals::
+
+    >>> [(num, chunk.astype({'concept_cd': object}).equals(facts))
+    ...  for num, chunk in spill.chunks(20)][0]
+    (0, True)
+    >>> next(spill.chunks(20))[1].concept_cd.dtype.name
+    'category'
+
+Only a spill with all its chunks is complete::
+
+    >>> spill.complete(20)
+    False
+    >>> spill.finish(20, chunk_qty=2)
+    >>> spill.complete(20)
+    True
+    >>> spill.finish(21, chunk_qty=1)
+    >>> spill.complete(21)
+    False
+
+Codes such as `concept_cd` repeat a lot, so we store them
+dictionary-encoded::
+
+    >>> import pyarrow.parquet as pq
+    >>> str(pq.read_schema(str(spill.path(20, 0))).field('concept_cd').type)
+    ... # doctest: +ELLIPSIS
+    'dictionary<values=string, ...>'
+
+.. note:: pyarrow is required only to spill or replay.
+'''
+
+from pathlib import Path
+from typing import Iterator, List, Tuple
+import os
+import re
+
+import pandas as pd  # type: ignore
+
+
+class ChunkSpill(object):
+    '''Files of fact chunks under `directory`, by upload_id and chunk number.
+    '''
+    dictionary_columns = ['concept_cd', 'modifier_cd', 'valtype_cd',
+                          'provider_id', 'sourcesystem_cd']
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+
+    def __repr__(self) -> str:
+        return '%s(%s)' % (self.__class__.__name__, self.directory)
+
+    def path(self, upload_id: int, chunk_num: int) -> Path:
+        return self.directory / ('observation_fact_%d' % upload_id) / ('chunk_%05d.parquet' % chunk_num)
+
+    def done_path(self, upload_id: int) -> Path:
+        return self.path(upload_id, 0).with_name('chunks.done')
+
+    def write(self, upload_id: int, chunk_num: int, data: pd.DataFrame) -> Path:
+        import pyarrow as pa  # type: ignore
+        import pyarrow.parquet as pq  # type: ignore
+
+        dest = self.path(upload_id, chunk_num)
+        if not dest.parent.exists():
+            dest.parent.mkdir(parents=True)
+        coded = data.copy()
+        for name in self.dictionary_columns:
+            if name in coded.columns:
+                coded[name] = coded[name].astype('category')
+        table = pa.Table.from_pandas(coded, preserve_index=False)
+        # Write, then rename, so a chunk file is never partly written.
+        tmp = dest.with_name(dest.name + '.tmp')
+        pq.write_table(table, str(tmp))
+        os.replace(str(tmp), str(dest))
+        return dest
+
+    def chunk_nums(self, upload_id: int) -> List[int]:
+        d = self.path(upload_id, 0).parent
+        if not d.exists():
+            return []
+        found = [re.match(r'chunk_(\d+)\.parquet$', p.name) for p in d.iterdir()]
+        return sorted(int(m.group(1)) for m in found if m)
+
+    def finish(self, upload_id: int, chunk_qty: int) -> None:
+        '''Note that the upload's facts came in `chunk_qty` chunks, all written.
+        '''
+        dest = self.done_path(upload_id)
+        if not dest.parent.exists():
+            dest.parent.mkdir(parents=True)
+        tmp = dest.with_name(dest.name + '.tmp')
+        tmp.write_text('%d\n' % chunk_qty)
+        os.replace(str(tmp), str(dest))
+
+    def complete(self, upload_id: int) -> bool:
+        '''Are all of the upload's chunks here, per the marker from `finish`?
+        '''
+        done = self.done_path(upload_id)
+        if not done.exists():
+            return False
+        return self.chunk_nums(upload_id) == list(range(int(done.read_text())))
+
+    def chunks(self, upload_id: int) -> Iterator[Tuple[int, pd.DataFrame]]:
+        '''Read chunks of an upload, in order.
+        '''
+        import pyarrow.parquet as pq
+
+        for chunk_num in self.chunk_nums(upload_id):
+            yield chunk_num, pq.read_table(str(self.path(upload_id, chunk_num))).to_pandas()
@@ -3,6 +3,7 @@
 
 whenever sqlerror continue;
   drop table bene_chunks;
+  drop table bene_chunk_rows;
 whenever sqlerror exit;
 
 create table bene_chunks (
@@ -17,6 +18,16 @@ create table bene_chunks (
         constraint chunk_first check (bene_id_first is not null or chunk_num = 1)
         );
 
--- Can we refer to the table without error?
+/* Rows of each RIF table in each chunk, for progress estimates etc. */
+create table bene_chunk_rows (
+        chunk_qty integer not null,
+        chunk_num integer not null,
+        table_name varchar2(30) not null,
+        row_qty integer not null,
+        constraint bene_chunk_rows_pk primary key (chunk_qty, chunk_num, table_name)
+        );
+
+-- Can we refer to the tables without error?
 select coalesce((select 1 from bene_chunks where bene_id_qty > 0 and rownum=1), 1) complete
-from dual;
+from dual
+where not exists (select 1 from bene_chunk_rows where 1 = 0);
@@ -1,4 +1,7 @@
 /** bene_chunks_survey - survey bene_id values and group into chunks
+
+Also count rows of each RIF table by chunk, so that loading a chunk
+can estimate its progress without a count(*) scan.
 */
 
 select chunk_num from bene_chunks where 'dep' = 'bene_chunks_create.sql';
@@ -29,10 +32,49 @@ select :chunk_qty
 order by chunk_num
     ;
 
+insert into bene_chunk_rows (
+          chunk_qty
+        , chunk_num
+        , table_name
+        , row_qty
+)
+select bc.chunk_qty, bc.chunk_num, rif.table_name, count(*) row_qty
+from bene_chunks bc
+join (
+  select /*+ parallel(12) */ 'mbsf_ab_summary' table_name, bene_id from "&&CMS_RIF".mbsf_ab_summary
+  union all
+  select /*+ parallel(12) */ 'maxdata_ps' table_name, bene_id from "&&CMS_RIF".maxdata_ps
+  union all
+  select /*+ parallel(12) */ 'medpar_all' table_name, bene_id from "&&CMS_RIF".medpar_all
+  union all
+  select /*+ parallel(12) */ 'maxdata_ip' table_name, bene_id from "&&CMS_RIF".maxdata_ip
+  union all
+  select /*+ parallel(12) */ 'bcarrier_claims' table_name, bene_id from "&&CMS_RIF".bcarrier_claims
+  union all
+  select /*+ parallel(12) */ 'bcarrier_line' table_name, bene_id from "&&CMS_RIF".bcarrier_line
+  union all
+  select /*+ parallel(12) */ 'outpatient_base_claims' table_name, bene_id from "&&CMS_RIF".outpatient_base_claims
+  union all
+  select /*+ parallel(12) */ 'outpatient_revenue_center' table_name, bene_id
+  from "&&CMS_RIF".outpatient_revenue_center
+  union all
+  select /*+ parallel(12) */ 'maxdata_ot' table_name, bene_id from "&&CMS_RIF".maxdata_ot
+  union all
+  select /*+ parallel(12) */ 'pde' table_name, bene_id from "&&CMS_RIF".pde
+  union all
+  select /*+ parallel(12) */ 'maxdata_rx' table_name, bene_id from "&&CMS_RIF".maxdata_rx
+) rif on rif.bene_id between bc.bene_id_first and bc.bene_id_last
+where bc.chunk_qty = :chunk_qty
+group by bc.chunk_qty, bc.chunk_num, rif.table_name
+    ;
+
 select case
     when (select count(distinct chunk_num)
     from bene_chunks
     where chunk_qty = &&chunk_qty) = &&chunk_qty
+    and (select count(distinct chunk_num)
+    from bene_chunk_rows
+    where chunk_qty = &&chunk_qty) = &&chunk_qty
     then 1
     else 0
     end complete
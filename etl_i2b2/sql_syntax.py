@@ -222,6 +222,18 @@ def inserted_tables(statement: SQL) -> List[Name]:
     return [m.group(1)] if m else []
 
 
+def ddl_tables(statement: SQL) -> List[Name]:
+    r'''Find tables that a statement creates, alters, or drops (without schema).
+
+    >>> ddl_tables('alter table "I2B2DEMODATA".patient_dimension add(ethnicity_cd varchar2(50 byte))')
+    ['patient_dimension']
+    >>> ddl_tables('create table t as ...'), ddl_tables('insert into t (...) ...')
+    (['t'], [])
+    '''
+    m = re.search(r'^(?:create|alter|drop)\s+table\s+([^\s(]+)', statement.strip(), re.IGNORECASE)
+    return [m.group(1).split('.')[-1].strip('"').lower()] if m else []
+
+
 def insert_append_table(statement: SQL) -> Optional[Name]:
     if '/*+ append' in statement:
         [t] = inserted_tables(statement)
@@ -0,0 +1,100 @@
+'''stay_bench -- time `MedparMapped.pat_day_stays` against a cartesian join
+
+Usage::
+
+    python stay_bench.py [bene_qty [max_stays [day_qty]]]
+
+Synthetic stays and patient days come from `StayTestData`, which
+`cms_pd` doctests use too::
+
+    >>> stays = StayTestData.stays(Random(1), bene_qty=3, max_stays=2)
+    >>> list(stays.columns)
+    ['medpar_id', 'bene_id', 'encounter_num', 'admsn_dt', 'dschrg_dt']
+
+Missing arguments take their defaults one by one::
+
+    >>> bench_args(['stay_bench.py', '100'])
+    [100, 500, 100000]
+'''
+
+from random import Random
+from typing import Dict, List, Tuple
+import logging
+
+import pandas as pd  # type: ignore
+
+from cms_pd import MedparMapped
+
+log = logging.getLogger(__name__)
+
+
+class StayTestData(object):
+    '''Synthetic MEDPAR stays and patient days, for testing and benchmarking `pat_day_stays`.
+    '''
+    origin = pd.Timestamp('2001-01-01')
+
+    @classmethod
+    def stays(cls, rng: Random, bene_qty: int, max_stays: int) -> pd.DataFrame:
+        '''Make 1 to `max_stays` stays per beneficiary, in medpar_id order, like `encounter_mapping`.
+        '''
+        records = []
+        for bene_ix in range(bene_qty):
+            for _ in range(rng.randint(1, max_stays)):
+                admsn = rng.randint(0, 10 * max_stays)
+                records.append(dict(medpar_id='m%08d' % rng.randint(0, 10 ** 8),
+                                    bene_id='b%06d' % bene_ix,
+                                    admsn_day=admsn,
+                                    dschrg_day=admsn + rng.choice([0, 1, 3, 7, 30])))
+        out = pd.DataFrame(records).sort_values('medpar_id').reset_index(drop=True)
+        out['encounter_num'] = out.index + 1
+        out['admsn_dt'] = cls.origin + pd.to_timedelta(out.admsn_day, unit='D')
+        out['dschrg_dt'] = cls.origin + pd.to_timedelta(out.dschrg_day, unit='D')
+        return out[['medpar_id', 'bene_id', 'encounter_num', 'admsn_dt', 'dschrg_dt']]
+
+    @classmethod
+    def pat_days(cls, rng: Random, stays: pd.DataFrame, qty: int) -> pd.DataFrame:
+        '''Pick patient days near those stays, including some patients with no stays.
+        '''
+        benes = list(stays.bene_id.unique()) + ['b_no_stays']
+        horizon = (stays.dschrg_dt.max() - cls.origin).days
+        out = pd.DataFrame(dict(bene_id=[rng.choice(benes) for _ in range(qty)],
+                                day=[rng.randint(-5, horizon + 5) for _ in range(qty)]))
+        out['start_day'] = cls.origin + pd.to_timedelta(out.day, unit='D')
+        return out[['bene_id', 'start_day']].drop_duplicates().reset_index(drop=True)
+
+    @classmethod
+    def benchmark(cls, bene_qty: int=1000, max_stays: int=500, day_qty: int=100000,
+                  seed: int=1) -> Dict[str, float]:
+        '''Time `pat_day_stays` and its reference implementation; check that they agree.
+
+        :return: seconds by implementation, along with stay and patient day counts
+        '''
+        from time import time
+
+        rng = Random(seed)
+        stays = cls.stays(rng, bene_qty, max_stays)
+        pat_day = cls.pat_days(rng, stays, day_qty)
+        results = {}  # type: Dict[str, pd.DataFrame]
+        timing = dict(stays=float(len(stays)), pat_days=float(len(pat_day)))
+        for name, impl in [('searchsorted', MedparMapped.pat_day_stays),
+                           ('merge', MedparMapped.pat_day_stays_merge)]:
+            t0 = time()
+            results[name] = impl(pat_day, stays)
+            timing[name] = time() - t0
+        assert (results['searchsorted'] == results['merge']).all().all()
+        return timing
+
+
+def bench_args(argv: List[str], defaults: Tuple[int, ...]=(1000, 500, 100000)) -> List[int]:
+    args = [int(arg) for arg in argv[1:len(defaults) + 1]]
+    return args + list(defaults[len(args):])
+
+
+if __name__ == '__main__':
+    def _script() -> None:
+        from sys import argv
+
+        logging.basicConfig(level=logging.INFO)
+        bene_qty, max_stays, day_qty = bench_args(argv)
+        log.info('pat_day_stays timing: %s', StayTestData.benchmark(bene_qty, max_stays, day_qty))
+    _script()
@@ -0,0 +1,224 @@
+'''ttl_store -- remember things for a while, optionally in a file
+
+`schema_cache`, `plan_cache`, and the completion caches in
+`etl_tasks` each remember answers from the database for a while
+(`ttl`) rather than asking again. A `TTLStore` holds such entries
+by key, with the time each was stored.
+
+Let's try it out with a clock we control::
+
+    >>> clock = _TestClock()
+    >>> store = TTLStore(clock=clock)
+    >>> hour = timedelta(hours=1)
+    >>> store.get('t1', ttl=hour) is None
+    True
+    >>> store.put('t1', ['concept_cd', 'nval_num'])
+    >>> store.get('t1', ttl=hour), store.hits, store.misses
+    (['concept_cd', 'nval_num'], 1, 1)
+
+Entries expire after `ttl`, or when forgotten::
+
+    >>> clock.advance(2 * hour)
+    >>> store.get('t1', ttl=hour) is None
+    True
+    >>> store.put_all({('db', 't1'): 1, ('db', 't2'): 2, ('other', 't1'): 3})
+    >>> store.forget_where(lambda key: key[1] == 't1')
+    2
+    >>> store.get(('db', 't2'), ttl=hour)
+    2
+
+With a `path`, a new store (e.g. in another process) starts with
+what earlier ones stored, and sees what others store or forget::
+
+    >>> from tempfile import mkdtemp
+    >>> path = Path(mkdtemp()) / 'store.pkl'
+    >>> TTLStore(path, clock=clock).put('t1', 'details')
+    >>> mine = TTLStore(path, clock=clock)
+    >>> mine.get('t1', ttl=hour)
+    'details'
+    >>> TTLStore(path, clock=clock).forget('t1')
+    >>> mine.get('t1', ttl=hour) is None
+    True
+
+Each change re-reads the file and replaces it while holding a lock
+on it, so stores in concurrent processes don't lose each other's
+entries, nor bring back ones that another has forgotten::
+
+    >>> a, b = TTLStore(path, clock=clock), TTLStore(path, clock=clock)
+    >>> a.put('t1', 1)
+    >>> b.put('t2', 2)
+    >>> a.forget('t1')
+    >>> b.put('t3', 3)
+    >>> sorted(TTLStore(path, clock=clock)._load())
+    ['t2', 't3']
+
+With `per_process`, entries from a parent process (e.g. before luigi
+forks a worker) don't count::
+
+    >>> store = TTLStore(clock=clock, per_process=True)
+    >>> store.put('cms_keys', True)
+    >>> store.peek('cms_keys')
+    True
+    >>> store._entries['cms_keys'] = (-1,) + store._entries['cms_keys'][1:]  # as if forked
+    >>> store.peek('cms_keys') is None, store.get('cms_keys', ttl=hour) is None
+    (True, True)
+
+'''
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from threading import Lock
+from typing import Any, Callable, Dict, Generic, Hashable, Iterator, Optional as Opt, Tuple, Type, TypeVar
+import fcntl
+import os
+import pickle
+
+V = TypeVar('V')
+S = TypeVar('S')
+Entry = Tuple[int, datetime, Any]  # pid, when stored, value
+
+
+class TTLStore(Generic[V]):
+    '''Values by key, each good for a `ttl` given when we look it up.
+
+    :param path: file to persist entries in (pickled), if any
+    :param clock: for testing
+    :param per_process: ignore entries stored by other processes
+    '''
+    def __init__(self, path: Opt[Path]=None,
+                 clock: Callable[[], datetime]=datetime.now,
+                 per_process: bool=False) -> None:
+        self.path = path
+        self.per_process = per_process
+        self._clock = clock
+        self._entries = None  # type: Opt[Dict[Hashable, Entry]]
+        self._version = None  # type: Opt[Tuple[int, int, int]]
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self) -> str:
+        return '%s(%s, hits=%d, misses=%d)' % (
+            self.__class__.__name__, self.path, self.hits, self.misses)
+
+    def now(self) -> datetime:
+        return self._clock()
+
+    def get(self, key: Hashable, ttl: timedelta) -> Opt[V]:
+        '''Get the value for `key`, if stored within `ttl`, counting hits and misses.
+        '''
+        with self._lock:
+            entry = self._live(key)
+            if entry is not None and self._clock() - entry[1] < ttl:
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+            return None
+
+    def peek(self, key: Hashable) -> Opt[V]:
+        '''Get the value for `key`, however old, e.g. to update it in place.
+        '''
+        with self._lock:
+            entry = self._live(key)
+            return None if entry is None else entry[2]
+
+    def put(self, key: Hashable, value: V) -> None:
+        self.put_all({key: value})
+
+    def put_all(self, values: Dict[Hashable, V]) -> None:
+        with self._changing() as entries:
+            stamp = (os.getpid(), self._clock())
+            for key, value in values.items():
+                entries[key] = stamp + (value,)
+            self._save()
+
+    def forget(self, key: Hashable) -> None:
+        self.forget_where(lambda k: k == key)
+
+    def forget_where(self, match: Callable[[Hashable], bool]) -> int:
+        '''Forget entries whose keys `match`.
+
+        :return: count of entries forgotten
+        '''
+        with self._changing() as entries:
+            gone = [key for key in entries if match(key)]
+            for key in gone:
+                del entries[key]
+            if gone:
+                self._save()
+        return len(gone)
+
+    @contextmanager
+    def _changing(self) -> Iterator[Dict[Hashable, Entry]]:
+        '''Get entries to change, fresh from `path` and locked against
+        other processes until we `_save` them.
+        '''
+        with self._lock:
+            if self.path is None:
+                yield self._load()
+                return
+            with self.path.with_name(self.path.name + '.lock').open('a') as lock_fp:
+                fcntl.flock(lock_fp, fcntl.LOCK_EX)
+                try:
+                    self._entries = None  # don't trust (ino, mtime, size) to tell
+                    yield self._load()
+                finally:
+                    fcntl.flock(lock_fp, fcntl.LOCK_UN)
+
+    def _live(self, key: Hashable) -> Opt[Entry]:
+        entry = self._load().get(key)
+        if entry is None or (self.per_process and entry[0] != os.getpid()):
+            return None
+        return entry
+
+    def _load(self) -> Dict[Hashable, Entry]:
+        version = self._file_version()
+        if self._entries is None or version != self._version:
+            self._entries = {}
+            if self.path is not None and version is not None:
+                # ISSUE: unpickling trusts the file; keep it where only the ETL account can write.
+                with self.path.open('rb') as fp:
+                    self._entries = pickle.load(fp)
+            self._version = version
+        return self._entries
+
+    def _file_version(self) -> Opt[Tuple[int, int, int]]:
+        '''Identify the contents of `path`, which `_save` replaces rather than rewrites.
+        '''
+        if self.path is None or not self.path.exists():
+            return None
+        st = self.path.stat()
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _save(self) -> None:
+        if self.path is None:
+            return
+        tmp = self.path.with_name('%s.%d.tmp' % (self.path.name, os.getpid()))
+        with tmp.open('wb') as fp:
+            pickle.dump(self._entries, fp)
+        os.replace(str(tmp), str(self.path))
+        self._version = self._file_version()
+
+
+_shared = {}  # type: Dict[Tuple[type, Opt[str]], Any]
+
+
+def shared(cls: Type[S], path: Opt[str]=None) -> S:
+    '''Get the process-wide `cls` (e.g. `schema_cache.SchemaCache`) for `path`.
+    '''
+    key = (cls, path)
+    if key not in _shared:
+        _shared[key] = cls(Path(path) if path else None)  # type: ignore
+    return _shared[key]
+
+
+class _TestClock(object):
+    def __init__(self, start: datetime=datetime(2001, 1, 1)) -> None:
+        self.now = start
+
+    def __call__(self) -> datetime:
+        return self.now
+
+    def advance(self, delta: timedelta) -> None:
+        self.now += delta